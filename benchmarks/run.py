@@ -0,0 +1,288 @@
+# - coding: utf-8 -
+
+# This file is part of 'hamster-lite'.
+
+# 'hamster-lite' is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# 'hamster-lite' is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with 'hamster-lite'.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Time the storage, parsing and reporting hot paths.
+
+Results go to stdout (or --output) as JSON, a summary goes to stderr.
+Each scenario is run once untimed, then --repeat times; the per call
+times are reported in milliseconds.
+
+With --baseline, the medians are compared with those of an earlier run,
+and the exit status is 1 if any scenario got slower than --max-slowdown
+times its baseline - eg. the command line startup, against the results
+from before a change.
+"""
+
+import argparse
+import datetime as dt
+import itertools
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from synthetic import make_storage
+import hamster_lite
+from hamster_lite import reports
+from hamster_lite.lib import Fact, i18n, parse_fact
+from hamster_lite.lib.stuff import hamster_now, hamster_today
+
+SCRIPT = os.path.join(os.path.dirname(__file__), "../src/hamster-lite")
+
+
+class Scenario(object):
+    def __init__(self, name, func, setup=None, number=1):
+        self.name = name
+        self.func = func
+        self.setup = setup  # called untimed before each run
+        self.number = number  # calls of func per run
+
+    def run(self, repeat):
+        times = []
+        for i in range(repeat + 1):
+            if self.setup:
+                self.setup()
+            start = time.perf_counter()
+            for j in range(self.number):
+                self.func()
+            elapsed = time.perf_counter() - start
+            if i:  # first run is warm-up
+                times.append(elapsed * 1000 / self.number)
+        return {
+            "name": self.name,
+            "runs": repeat,
+            "number": self.number,
+            "min_ms": min(times),
+            "median_ms": statistics.median(times),
+            "max_ms": max(times),
+        }
+
+
+def get_facts_scenarios(storage):
+    today = hamster_today()
+    ranges = (("day", 0), ("week", 6), ("month", 30), ("year", 364))
+    for name, days in ranges:
+        start = today - dt.timedelta(days=days)
+        yield Scenario("get_facts_%s" % name,
+                       lambda start=start: storage.get_facts(start, today))
+        yield Scenario("get_facts_%s_search" % name,
+                       lambda start=start: storage.get_facts(
+                           start, today, "activity*"))
+
+
+def totals_scenarios(storage):
+    today = hamster_today()
+    start = today - dt.timedelta(days=364)
+
+    def sum_facts():
+        totals = {}
+        for fact in storage.iter_facts(start, today):
+            totals[fact.category] = totals.get(fact.category,
+                                               dt.timedelta()) + fact.delta
+        return totals
+    yield Scenario("totals_year_from_facts", sum_facts)
+    for group_by in ("day", "category", "tag"):
+        yield Scenario("get_totals_year_%s" % group_by,
+                       lambda group_by=group_by: storage.get_totals(
+                           start, today, group_by))
+        yield Scenario("get_day_totals_year_%s" % group_by,
+                       lambda group_by=group_by: storage.get_day_totals(
+                           start, today, group_by))
+    yield Scenario("rebuild_day_totals", storage.rebuild_day_totals)
+
+
+def add_fact_scenarios(storage):
+    # a new fact over 10:00-12:00 splits and truncates the synthetic
+    # facts of a past day, one day further back for each call
+    days = itertools.count(7)
+
+    def add_overlapping():
+        day = hamster_today() - dt.timedelta(days=next(days))
+        start_time = dt.datetime.combine(day, dt.time(10, 0))
+        storage.add_fact(Fact(activity="overlap", category="benchmark",
+                              tags=["bench"], start_time=start_time,
+                              end_time=start_time + dt.timedelta(hours=2)))
+    yield Scenario("add_fact_overlaps", add_overlapping)
+
+    activities = itertools.cycle(("activity 1", "activity 2"))
+
+    def start_now():
+        storage.add_fact(Fact(activity=next(activities),
+                              start_time=hamster_now()))
+    yield Scenario("add_fact_ongoing", start_now)
+
+    # importing 200 facts, 8 a day, into days before the synthetic data
+    import_days = itertools.count(5 * 365)
+
+    def import_facts():
+        facts = []
+        for i in range(25):
+            day = hamster_today() - dt.timedelta(days=next(import_days))
+            start_time = dt.datetime.combine(day, dt.time(8, 0))
+            for j in range(8):
+                end_time = start_time + dt.timedelta(minutes=45)
+                facts.append(Fact(activity="import %d" % (j % 3),
+                                  category="history", tags=["import"],
+                                  start_time=start_time, end_time=end_time))
+                start_time = end_time
+        return facts
+    yield Scenario("import_200_add_fact",
+                   lambda: [storage.add_fact(fact) for fact in import_facts()])
+    yield Scenario("import_200_add_facts",
+                   lambda: storage.add_facts(import_facts(), "skip"))
+
+
+def parse_scenarios(storage):
+    yield Scenario("parse_fact",
+                   lambda: parse_fact("12:25-13:25 case@cat,"
+                                      " description #ta non-tag #tag #bäg"),
+                   number=1000)
+
+
+def suggestion_scenarios(storage):
+    try:
+        from hamster_lite.widgets.activityentry import CmdLineEntry
+    except ImportError:
+        return  # no GTK here
+
+    # the work of load_suggestions, without the widget and the worker
+    yield Scenario("load_suggestions",
+                   lambda: CmdLineEntry.find_suggestions(storage))
+
+
+def report_scenarios(storage):
+    today = hamster_today()
+    start = today - dt.timedelta(days=30)
+    facts = storage.get_facts(start, today)
+    for format in ("tsv", "xml", "ical", "html"):
+        yield Scenario("report_%s_month" % format,
+                       lambda format=format: reports.simple(
+                           facts, start, today, format, os.devnull))
+
+
+def cli_scenarios(storage):
+    # the db lives in <tmp>/hamster-lite, so <tmp> is the XDG data home.
+    # the config goes next to it, away from the one of the user
+    data_home = os.path.dirname(os.path.dirname(storage.db_path))
+    env = dict(os.environ, XDG_DATA_HOME=data_home,
+               XDG_CONFIG_HOME=os.path.join(data_home, "config"))
+    # the interpreter alone, which every run pays before any of our code
+    yield Scenario("cli_python_startup",
+                   lambda: subprocess.run([sys.executable, "-c", "pass"],
+                                          env=env, check=True))
+    # the script and the modules it always needs
+    yield Scenario("cli_help",
+                   lambda: subprocess.run([sys.executable, SCRIPT, "--help"],
+                                          env=env, check=True,
+                                          stdout=subprocess.DEVNULL))
+    for action in ("current", "list"):
+        yield Scenario("cli_%s" % action,
+                       lambda action=action: subprocess.run(
+                           [sys.executable, SCRIPT, action], env=env,
+                           check=True, stdout=subprocess.DEVNULL))
+
+
+def slower_than_baseline(results, path, max_slowdown):
+    """(name, baseline ms, ms) of the results over max_slowdown times the
+    median of the same scenario in the results saved at path"""
+    with open(path) as f:
+        baseline = {result["name"]: result["median_ms"]
+                    for result in json.load(f)["results"]}
+    return [(result["name"], baseline[result["name"]], result["median_ms"])
+            for result in results
+            if result["name"] in baseline
+            and result["median_ms"] > baseline[result["name"]] * max_slowdown]
+
+
+SCENARIOS = (get_facts_scenarios, totals_scenarios, add_fact_scenarios,
+             parse_scenarios, suggestion_scenarios, report_scenarios,
+             cli_scenarios)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--years", type=float, default=2)
+    parser.add_argument("--activities", type=int, default=50)
+    parser.add_argument("--categories", type=int, default=8)
+    parser.add_argument("--tags", type=int, default=30)
+    parser.add_argument("--facts-per-day", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--filter", default="",
+                        help="only run scenarios with this in their name")
+    parser.add_argument("--output", help="write the JSON results here")
+    parser.add_argument("--baseline",
+                        help="JSON results of an earlier run to compare with")
+    parser.add_argument("--max-slowdown", type=float, default=1.25,
+                        help="fail if a scenario takes longer than this"
+                        " times its baseline (default: %(default)s)")
+    args = parser.parse_args()
+
+    i18n.setup_i18n()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database_dir = os.path.join(tmp_dir, "hamster-lite")
+        os.makedirs(database_dir)
+        storage = make_storage(database_dir, years=args.years,
+                               activities=args.activities,
+                               categories=args.categories, tags=args.tags,
+                               facts_per_day=args.facts_per_day)
+        for scenarios in SCENARIOS:
+            for scenario in scenarios(storage):
+                if args.filter not in scenario.name:
+                    continue
+                result = scenario.run(args.repeat)
+                print("%-28s %10.3f ms"
+                      % (result["name"], result["median_ms"]), file=sys.stderr)
+                results.append(result)
+
+    report = {
+        "version": hamster_lite.__version__,
+        "date": dt.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "params": {key: value for key, value in vars(args).items()
+                   if key not in ("filter", "output", "baseline",
+                                  "max_slowdown")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        print()
+
+    if args.baseline:
+        slower = slower_than_baseline(results, args.baseline,
+                                      args.max_slowdown)
+        for name, before, after in slower:
+            print("%-28s %10.3f ms, was %.3f ms" % (name, after, before),
+                  file=sys.stderr)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
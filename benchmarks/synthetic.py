@@ -0,0 +1,108 @@
+# - coding: utf-8 -
+
+# This file is part of 'hamster-lite'.
+
+# 'hamster-lite' is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# 'hamster-lite' is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with 'hamster-lite'.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Synthetic hamster databases for the benchmarks."""
+
+import sys, os.path
+# a convoluted line to add hamster_lite module to absolute path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+
+import datetime as dt
+import random
+import shutil
+
+from hamster_lite.lib.stuff import hamster_today
+from hamster_lite.storage import Storage
+
+TEMPLATE_DB = os.path.join(os.path.dirname(__file__), "../data/hamster.db")
+
+
+def make_storage(database_dir, years=1, activities=50, categories=8, tags=30,
+                 facts_per_day=8, seed=0):
+    """Fill a fresh database in database_dir and return its Storage.
+
+    Days run back from today, each with facts_per_day back to back
+    facts of 15 minutes to 2 hours starting at 08:00, the last one of
+    today left ongoing. Each fact gets up to 3 tags.
+    """
+    random.seed(seed)
+    shutil.copy(TEMPLATE_DB, os.path.join(database_dir, "hamster.db"))
+    storage = Storage(database_dir=database_dir)
+
+    storage.executemany(
+        "INSERT INTO categories (id, name, search_name) VALUES (?, ?, ?)",
+        [(i, "category %d" % i, "category %d" % i)
+         for i in range(1, categories + 1)])
+    storage.executemany(
+        "INSERT INTO activities (id, name, search_name, category_id)"
+        " VALUES (?, ?, ?, ?)",
+        [(i, "activity %d" % i, "activity %d" % i,
+          random.randint(1, categories) if categories else -1)
+         for i in range(1, activities + 1)])
+    storage.executemany(
+        "INSERT INTO tags (id, name) VALUES (?, ?)",
+        [(i, "tag%d" % i) for i in range(1, tags + 1)])
+
+    facts, fact_tags = [], []
+    today = hamster_today()
+    fact_id = 0
+    for day in range(int(years * 365) - 1, -1, -1):
+        start_time = dt.datetime.combine(today - dt.timedelta(days=day),
+                                         dt.time(8, 0))
+        for i in range(facts_per_day):
+            fact_id += 1
+            end_time = start_time + dt.timedelta(
+                minutes=random.randint(15, 120))
+            if day == 0 and i == facts_per_day - 1:
+                end_time = None
+            facts.append((fact_id, random.randint(1, activities),
+                          start_time, end_time,
+                          "fact number %d" % fact_id))
+            for tag_id in random.sample(range(1, tags + 1),
+                                        random.randint(0, min(3, tags))):
+                fact_tags.append((fact_id, tag_id))
+            start_time = end_time
+
+    storage.executemany(
+        "INSERT INTO facts (id, activity_id, start_time, end_time,"
+        " description) VALUES (?, ?, ?, ?, ?)", facts)
+    storage.executemany(
+        "INSERT INTO fact_tags (fact_id, tag_id) VALUES (?, ?)", fact_tags)
+    return storage
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Create a synthetic hamster.db in the given directory.")
+    parser.add_argument("database_dir")
+    parser.add_argument("--years", type=float, default=1)
+    parser.add_argument("--activities", type=int, default=50)
+    parser.add_argument("--categories", type=int, default=8)
+    parser.add_argument("--tags", type=int, default=30)
+    parser.add_argument("--facts-per-day", type=int, default=8)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database_dir):
+        os.makedirs(args.database_dir)
+    make_storage(args.database_dir, years=args.years,
+                 activities=args.activities, categories=args.categories,
+                 tags=args.tags, facts_per_day=args.facts_per_day)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,8 +10,14 @@ try:
     installed = True
 except ImportError:
     # if defs is not there, we are running from sources
-    from subprocess import getstatusoutput
-    rc, output = getstatusoutput("git describe --tags --always --dirty=+")
-    __version__ = "" if rc else output + " (uninstalled)"
     installed = False
-    del getstatusoutput, rc, output
+
+    def __getattr__(name):
+        # asking git takes a while, so only when someone wants to know
+        global __version__
+        if name != "__version__":
+            raise AttributeError(name)
+        from subprocess import getstatusoutput
+        rc, output = getstatusoutput("git describe --tags --always --dirty=+")
+        __version__ = "" if rc else output + " (uninstalled)"
+        return __version__
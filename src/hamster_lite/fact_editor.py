@@ -20,14 +20,18 @@
 
 from gi.repository import Gtk as gtk
 from gi.repository import Gdk as gdk
+from gi.repository import GObject as gobject
 import datetime as dt
 
 from hamster_lite import widgets
 from hamster_lite.lib.configuration import conf
 from hamster_lite.lib.stuff import (
-    hamsterday_time_to_datetime, hamster_today, hamster_now)
+    hamsterday_time_to_datetime, hamster_today, hamster_now, escape_pango)
 from hamster_lite.lib import Fact, parse_fact
 
+# ms of no typing before the overlaps are looked up
+OVERLAP_DELAY = 150
+
 
 class FactEditor(gtk.Window):
 
@@ -46,6 +50,11 @@ class FactEditor(gtk.Window):
 
         self.date = hamster_today()
 
+        self._status = None
+        self._overlap_timeout = None
+        # bumped for every lookup, so that stale answers are dropped
+        self._overlap_request = 0
+
         mainbox = gtk.Box(spacing=6, orientation='vertical', can_focus=False)
         self.add(mainbox)
 
@@ -248,6 +257,7 @@ class FactEditor(gtk.Window):
 
     def update_status(self, status, markup):
         """Set save button sensitivity and tooltip."""
+        self._status = status
         self.save_button.set_tooltip_markup(markup)
         if status == "okay":
             self.save_button.set_label(_('Save'))
@@ -266,9 +276,52 @@ class FactEditor(gtk.Window):
         if not self.fact.activity:
             self.update_status(status="wrong", markup=_("Missing activity"))
             return None
-        self.update_status(status="okay", markup="")
+        if self._status == "wrong":
+            self.update_status(status="okay", markup="")
+        # tell what saving would do to the neighbouring facts, once typing
+        # pauses and off the main loop
+        if self._overlap_timeout:
+            gobject.source_remove(self._overlap_timeout)
+        self._overlap_timeout = gobject.timeout_add(OVERLAP_DELAY,
+                                                    self.on_overlap_timeout)
         return True
 
+    def on_overlap_timeout(self):
+        self._overlap_timeout = None
+        self._overlap_request += 1
+        if not self.fact.start_time:
+            self.on_overlaps_found((self._overlap_request, []))
+            return False
+        self._app.db_worker.submit(
+            self.find_overlaps, self.fact.start_time, self.fact.end_time,
+            self.fact_id, self._overlap_request,
+            callback=self.on_overlaps_found, deliver=gobject.idle_add)
+        return False
+
+    @staticmethod
+    def find_overlaps(storage, start_time, end_time, fact_id, request):
+        end_time, changes = storage.get_overlap_changes(
+            start_time, end_time, exclude_id=fact_id)
+        return request, changes
+
+    def on_overlaps_found(self, found):
+        request, changes = found
+        if request != self._overlap_request or self._status == "wrong":
+            return  # the fields changed since
+        if changes:
+            lines = [_("Saving changes other activities:")]
+            for fact, new in changes:
+                lines.append("%s: %s → %s" % (
+                    escape_pango(fact.activity), self._format_times(fact),
+                    self._format_times(new)))
+            self.update_status(status="warning", markup="\n".join(lines))
+        else:
+            self.update_status(status="okay", markup="")
+
+    def _format_times(self, fact):
+        end = fact.end_time.strftime("%H:%M") if fact.end_time else ""
+        return "%s - %s" % (fact.start_time.strftime("%H:%M"), end)
+
     def on_delete_clicked(self, button):
         self._app.db.remove_fact(self.fact_id)
         self.close_window()
@@ -309,5 +362,9 @@ class FactEditor(gtk.Window):
                 self.on_save_clicked(None)
 
     def close_window(self):
+        if self._overlap_timeout:
+            gobject.source_remove(self._overlap_timeout)
+            self._overlap_timeout = None
+        self._overlap_request += 1  # nobody is waiting for the answer
         self._gui = None
         self.destroy()
@@ -5,7 +5,6 @@ import calendar
 import datetime as dt
 import re
 
-from copy import deepcopy
 
 from hamster_lite.lib.stuff import (
     datetime_to_hamsterday,
@@ -76,6 +75,9 @@ def figure_time(str_time):
 
 
 class Fact(object):
+    __slots__ = ("_activity", "_category", "_description", "tags",
+                 "start_time", "end_time", "id", "activity_id", "category_id")
+
     def __init__(self, activity="", category=None, description=None, tags=None,
                  start_time=None, end_time=None, id=None, activity_id=None,
                  category_id=None):
@@ -139,7 +141,10 @@ class Fact(object):
         By default, only copy user-visible attributes.
         To also copy the id, use fact.copy(id=fact.id)
         """
-        fact = deepcopy(self)
+        fact = Fact.__new__(Fact)  # values are clean, skip the setters
+        for attr in self.__slots__:
+            setattr(fact, attr, getattr(self, attr))
+        fact.tags = list(self.tags)  # the only mutable attribute
         fact._set(**kwds)
         return fact
 
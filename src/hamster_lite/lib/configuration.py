@@ -23,8 +23,9 @@ logger = logging.getLogger(__name__)   # noqa: E402
 
 import os
 import json
+import time
 import datetime as dt
-from gi.repository import GLib as glib
+from hamster_lite.lib.stuff import user_config_dir
 
 class Singleton(object):
     def __new__(cls, *args, **kwargs):
@@ -40,11 +41,18 @@ class ConfStore(Singleton):
         'day_start_minutes' : 5 * 60 + 30,  # Virtual day start (5:30AM)
         'last_report_folder': "~",    # Where the last report was saved
         'escape_quits_main': True,    # Allow to quit Hamster on Escape key
+        'slow_query_ms': None,        # Log database queries slower than this
     }
 
+    # seconds between checks for changes made to the file by other processes
+    CHECK_INTERVAL = 1
+
     def __init__(self):
-        self.config = self.DEFAULTS
-        config_dir = os.path.join(glib.get_user_config_dir(), 'hamster-lite')
+        self.config = dict(self.DEFAULTS)
+        self._mtime = None
+        self._last_check = 0
+        self._day_start = None
+        config_dir = os.path.join(user_config_dir(), 'hamster-lite')
         if not os.path.exists(config_dir):
             os.makedirs(config_dir)
         self.config_file = os.path.join(config_dir, 'hamster-lite.json')
@@ -56,18 +64,40 @@ class ConfStore(Singleton):
     def _save_config(self):
         with open(self.config_file, 'w') as f:
             json.dump(self.config, f, sort_keys=True, indent=4)
+        self._mtime = os.stat(self.config_file).st_mtime
+        self._day_start = None
 
     def _load_config(self):
+        # stat first, so a write racing with the read is seen next time
+        self._mtime = os.stat(self.config_file).st_mtime
         with open(self.config_file, 'r') as f:
             self.config.update(json.load(f))
+        self._day_start = None
+
+    def _check_config(self):
+        """Reload the config file if its modification time has changed.
+
+        The file is looked at no more than once every CHECK_INTERVAL seconds,
+        so callers in loops get the in-memory values.
+        """
+        now = time.monotonic()
+        if now - self._last_check < self.CHECK_INTERVAL:
+            return
+        self._last_check = now
+
+        try:
+            mtime = os.stat(self.config_file).st_mtime
+        except OSError:
+            return
+        if mtime != self._mtime:
+            logger.info("reloading %s" % self.config_file)
+            self._load_config()
 
     def get(self, key):
         """
         Returns the value of the conf key
         """
-        # for now, update from config file every time (ugh)
-        # - later update config only on external file change
-        self._load_config()
+        self._check_config()
 
         if key not in self.DEFAULTS:
             logger.warn("Unknown config key: %s" % key)
@@ -88,9 +118,13 @@ class ConfStore(Singleton):
 
     @property
     def day_start(self):
-        """Start of the hamster day."""
-        day_start_minutes = self.config["day_start_minutes"]
-        hours, minutes = divmod(day_start_minutes, 60)
-        return dt.time(hours, minutes)
+        """Start of the hamster day, worked out again when the config
+        changes."""
+        self._check_config()
+        if self._day_start is None:
+            day_start_minutes = self.config["day_start_minutes"]
+            hours, minutes = divmod(day_start_minutes, 60)
+            self._day_start = dt.time(hours, minutes)
+        return self._day_start
 
 conf = ConfStore()
@@ -26,9 +26,8 @@ import json
 import datetime as dt
 from gi.repository import GObject as gobject
 from gi.repository import Gtk as gtk
-from gi.repository import GLib as glib
-import hamster_lite
 import hamster_lite.storage as db
+from hamster_lite.lib import stuff
 
 
 class Controller(gobject.GObject):
@@ -92,21 +91,15 @@ class RuntimeStore(Singleton):
     """XXX - kill"""
     data_dir = ""
     home_data_dir = ""
-    storage = None
 
     def __init__(self):
-        if hamster_lite.installed:
-            self.data_dir = os.path.join(hamster_lite.defs.DATA_DIR,
-                                         "hamster-lite")
-        else:
-            # we are running from sources
-            module_dir = os.path.dirname(os.path.realpath(__file__))
-            self.data_dir = os.path.join(module_dir, '..', '..', '..', 'data')
-
-        self.data_dir = os.path.realpath(self.data_dir)
+        self.data_dir = stuff.data_dir()
         self.home_data_dir = os.path.realpath(
-            os.path.join(glib.get_user_data_dir(), "hamster-lite"))
-        self.storage = db.Storage()
+            os.path.join(stuff.user_data_dir(), "hamster-lite"))
+
+    @property
+    def storage(self):
+        return db.get_storage()
 
 
 runtime = RuntimeStore()
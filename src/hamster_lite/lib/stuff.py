@@ -24,13 +24,6 @@
 import logging
 logger = logging.getLogger(__name__)   # noqa: E402
 
-import gi
-import datetime as dt
-
-gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk as gtk
-from gi.repository import Pango as pango
-
 from itertools import groupby
 import datetime as dt
 import calendar
@@ -40,6 +33,33 @@ import locale
 import os
 
 
+def user_data_dir():
+    """Return the XDG data home, same as GLib.get_user_data_dir().
+
+    Worked out by hand so that command line use does not need to load GLib.
+    """
+    return os.environ.get("XDG_DATA_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".local", "share")
+
+
+def user_config_dir():
+    """Return the XDG config home, same as GLib.get_user_config_dir()."""
+    return os.environ.get("XDG_CONFIG_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".config")
+
+
+def data_dir():
+    """Return the directory of the shipped data (ui files, templates, db)."""
+    import hamster_lite
+    if hamster_lite.installed:
+        path = os.path.join(hamster_lite.defs.DATA_DIR, "hamster-lite")
+    else:
+        # we are running from sources
+        module_dir = os.path.dirname(os.path.realpath(__file__))
+        path = os.path.join(module_dir, '..', '..', '..', 'data')
+    return os.path.realpath(path)
+
+
 def datetime_to_hamsterday(civil_date_time):
     """Return the hamster day corresponding to a given civil datetime.
 
@@ -72,7 +72,18 @@ class HamsterLite(Gtk.Application):
         """Triggered right at startup."""
         print(_("Hamster-lite started."))  # NOQA
         glib.set_application_name("Hamster-lite")
-        self.db = storage.Storage()
+        self.db = storage.get_storage()
+        # relay storage changes through GObject for the gtk side
+        self.db.connect("facts-changed",
+                        lambda db: self.signal.emit("facts-changed"))
+        # slow reads, like the overview's, go through here
+        self.db_worker = storage.get_executor()
+        # notice facts changed by the command line or other windows
+        glib.timeout_add_seconds(1, self._check_db)
+
+    def _check_db(self):
+        self.db.check_changes()
+        return True
 
     def _activate(self, app):
         """Triggered in regular use after startup."""
@@ -92,6 +103,7 @@ class HamsterLite(Gtk.Application):
 
     def _shutdown(self, app):
         """Triggered upon termination."""
+        self.db_worker.shutdown()
         print(_('Hamster-lite shut down.'))  # NOQA
 
     def _on_quit(self, action, parameter):
@@ -22,6 +22,7 @@ import datetime as dt
 import webbrowser
 
 from collections import defaultdict
+from functools import partial
 
 from gi.repository import Gtk as gtk
 from gi.repository import Gdk as gdk
@@ -32,10 +33,14 @@ from hamster_lite import widgets, reports
 from hamster_lite.lib import stuff
 from hamster_lite.lib.runtime import dialogs
 from hamster_lite.lib.configuration import conf
+from hamster_lite.storage import RangeCache, Storage
 from hamster_lite.widgets.dates import RangePick
 from hamster_lite.widgets.facttree import FactTree
 from hamster_lite.about import About
 
+# ms of no typing before the search runs
+SEARCH_DELAY = 150
+
 
 class HeaderBar(gtk.HeaderBar):
     def __init__(self):
@@ -111,16 +116,34 @@ class HeaderBar(gtk.HeaderBar):
 class Totals(gtk.Label):
     def __init__(self):
         super().__init__()
+        self.has_facts = False
+        self.closed_total = dt.timedelta()
+        self.closed_sub_totals = defaultdict(dt.timedelta)
+        self.ongoing_facts = []
 
     def update_totals(self, facts):
-        grand_total = dt.timedelta(minutes=0)
-        sub_totals = defaultdict(dt.timedelta)
+        """Sum up finished facts once; ongoing ones are added in refresh."""
+        self.has_facts = bool(facts)
+        self.closed_total = dt.timedelta()
+        self.closed_sub_totals = defaultdict(dt.timedelta)
+        self.ongoing_facts = []
         for fact in facts:
-            end_time = fact.end_time or stuff.hamster_now()
-            delta = end_time - fact.start_time
+            if fact.end_time:
+                delta = fact.end_time - fact.start_time
+                self.closed_total += delta
+                self.closed_sub_totals[fact.category] += delta
+            else:
+                self.ongoing_facts.append(fact)
+        self.refresh()
+
+    def refresh(self):
+        grand_total = self.closed_total
+        sub_totals = defaultdict(dt.timedelta, self.closed_sub_totals)
+        for fact in self.ongoing_facts:
+            delta = stuff.hamster_now() - fact.start_time
             grand_total += delta
             sub_totals[fact.category] += delta
-        if facts:
+        if self.has_facts:
             line = f"<b>Total </b> " \
                 f"{stuff.format_duration(grand_total, human=False)}"
         else:
@@ -142,8 +165,7 @@ class Overview(gtk.ApplicationWindow):
         super().__init__(*args, **kwargs)
 
         self._app = app
-        self._app.db.connect("facts-changed", self.on_facts_changed)
-        #self._app.signal.connect("facts-changed", self.on_facts_changed)
+        self._app.signal.connect("facts-changed", self.on_facts_changed)
         #self._app.signal.connect("activities-changed", self.on_facts_changed)
 
         self.set_position(gtk.WindowPosition.CENTER)
@@ -193,6 +215,12 @@ class Overview(gtk.ApplicationWindow):
         self.connect("key-press-event", self.on_key_press)
 
         self.facts = []
+        self.facts_day = None
+        self._facts_request = None
+        self._facts_futures = []
+        self.facts_cache = RangeCache(self._app.db)
+        self._search_found = None  # (start, end, text, facts) shown last
+        self._search_timeout = None
         self.find_facts()
 
         # update every minute (necessary if an activity is running)
@@ -271,9 +299,52 @@ class Overview(gtk.ApplicationWindow):
     def find_facts(self):
         start, end = self.header_bar.range_pick.get_range()
         search_active = self.header_bar.search_button.get_active()
-        search = "" if not search_active else self.filter_entry.get_text()
-        search = "%s*" % search if search else "" # search anywhere
-        self.facts = self._app.db.get_facts(start, end, search_terms=search)
+        text = "" if not search_active else self.filter_entry.get_text()
+        search = "%s*" % text if text else ""  # search anywhere
+
+        # queries still waiting in the worker's queue are not needed anymore
+        for future in self._facts_futures:
+            future.cancel()
+        self._facts_futures = []
+
+        # the facts shown stay up until the new ones come from the worker
+        request = self._facts_request = (start, end, text)
+        key = (start, end, search)
+        facts = self.facts_cache.get(key)
+        if facts is not None:
+            self.on_facts_found(request, facts)
+        else:
+            found = self._search_found
+            if (text and found and found[:2] == (start, end) and found[2]
+                    and text.startswith(found[2])
+                    and not text.lower().startswith("not")):
+                # typed on, so only the facts found so far can still match
+                self.fetch_facts(key, partial(self.on_facts_found, request),
+                                 Storage.filter_facts, found[3], search)
+            else:
+                self.fetch_facts(key, partial(self.on_facts_found, request))
+
+        if not text:
+            # have the ranges either side ready for the arrow keys
+            range_pick = self.header_bar.range_pick
+            for near_start, near_end in (range_pick.get_prev_range(),
+                                         range_pick.get_next_range()):
+                near_key = (near_start, near_end, "")
+                if self.facts_cache.get(near_key) is None:
+                    self.fetch_facts(near_key)
+
+    def fetch_facts(self, key, callback=None, func=None, *args):
+        """get the facts for key on the storage worker, through the cache"""
+        self._facts_futures.append(self.facts_cache.fetch(
+            self._app.db_worker, key, func, *args, callback=callback,
+            deliver=gobject.idle_add))
+
+    def on_facts_found(self, request, facts):
+        if request is not self._facts_request:
+            return  # a newer search is on its way
+        self._search_found = request + (facts,)
+        self.facts = facts
+        self.facts_day = stuff.hamster_today()
         self.fact_tree.update_facts(self.facts)
         self.totals.update_totals(self.facts)
         self.header_bar.stop_button.set_sensitive(
@@ -290,13 +361,23 @@ class Overview(gtk.ApplicationWindow):
         else:
             self.filter_entry.set_icon_from_icon_name(
                 gtk.EntryIconPosition.SECONDARY, None)
+        # search once typing pauses, not for every key
+        if self._search_timeout:
+            gobject.source_remove(self._search_timeout)
+        self._search_timeout = gobject.timeout_add(SEARCH_DELAY,
+                                                   self.on_search_timeout)
+
+    def on_search_timeout(self):
+        self._search_timeout = None
         self.find_facts()
+        return False
 
     def on_search_icon_press(self, entry, position, event):
         if position == gtk.EntryIconPosition.SECONDARY:
             self.filter_entry.set_text("")
 
     def on_facts_changed(self, event):
+        self._search_found = None  # the facts we have may be out of date
         self.find_facts()
 
     def on_add_clicked(self, button):
@@ -312,8 +393,14 @@ class Overview(gtk.ApplicationWindow):
             self.filter_entry.grab_focus()
 
     def on_timeout(self):
-        # TODO: should update only the running FactTree row (if any), and totals
-        self.find_facts()
+        if self.facts_day != stuff.hamster_today():
+            # new hamster day, dates and "Today" labels have moved
+            self.find_facts()
+        else:
+            # only durations of ongoing facts change with time,
+            # any stored change triggers on_facts_changed instead
+            self.fact_tree.update_ongoing()
+            self.totals.refresh()
         # The timeout will stop if returning False
         return True
 
@@ -29,6 +29,7 @@ from hamster_lite.lib.configuration import conf
 from hamster_lite.lib.runtime import runtime, Controller
 from hamster_lite import widgets
 from hamster_lite.lib import stuff
+import hamster_lite.storage as db
 
 
 def get_prev(selection, model):
@@ -45,10 +46,10 @@ class CategoryStore(gtk.ListStore):
     def __init__(self):
         #id, name, color_code, order
         gtk.ListStore.__init__(self, int, str)
+        self.load([])
 
-    def load(self):
-        category_list = runtime.storage.get_categories()
-
+    def load(self, category_list):
+        self.clear()
         for category in category_list:
             self.append([category['id'], category['name']])
 
@@ -59,14 +60,28 @@ class ActivityStore(gtk.ListStore):
     def __init__(self):
         #id, name, category_id, order
         gtk.ListStore.__init__(self, int, str, int)
+        self.category_id = None  # of the activities listed
 
     def load(self, category_id):
         self.clear()
+        self.category_id = category_id
 
         if category_id is None:
             return
 
-        activity_list = runtime.storage.get_category_activities(category_id)
+        # read on the storage worker, the list stays empty until then
+        db.get_executor().submit(self.find_activities, category_id,
+                                 callback=self.on_activities_found,
+                                 deliver=gobject.idle_add)
+
+    @staticmethod
+    def find_activities(storage, category_id):
+        return category_id, storage.get_category_activities(category_id)
+
+    def on_activities_found(self, found):
+        category_id, activity_list = found
+        if category_id != self.category_id:
+            return  # another category got selected since
 
         for activity in activity_list:
             self.append([activity['id'],
@@ -134,7 +149,6 @@ class PreferencesEditor(Controller):
         self.categoryColumn.set_cell_data_func(self.categoryCell, self.unsorted_painter)
         self.category_tree.append_column(self.categoryColumn)
 
-        self.category_store.load()
         self.category_tree.set_model(self.category_store)
 
         selection = self.category_tree.get_selection()
@@ -161,9 +175,10 @@ class PreferencesEditor(Controller):
 
         self.category_tree.connect("drag_data_received", self.on_category_drop)
 
-        #select first category
-        selection = self.category_tree.get_selection()
-        selection.select_path((0,))
+        # the first category gets selected once they are read
+        db.get_executor().submit(db.Storage.get_categories,
+                                 callback=self.on_categories_found,
+                                 deliver=gobject.idle_add)
 
         self.prev_selected_activity = None
         self.prev_selected_category = None
@@ -180,10 +195,23 @@ class PreferencesEditor(Controller):
         self.window.show_all()
 
 
+    def on_categories_found(self, category_list):
+        self.category_store.load(category_list)
+        #select first category
+        selection = self.category_tree.get_selection()
+        selection.select_path((0,))
+
+
     def load_config(self, *args):
         self.day_start.time = conf.day_start
 
-        self.tags = [tag["name"] for tag in runtime.storage.get_tags(only_autocomplete=True)]
+        self.tags = []
+        db.get_executor().submit(db.Storage.get_tags, only_autocomplete=True,
+                                 callback=self.on_tags_found,
+                                 deliver=gobject.idle_add)
+
+    def on_tags_found(self, tags):
+        self.tags = [tag["name"] for tag in tags]
         self.get_widget("autocomplete_tags").set_text(", ".join(self.tags))
 
 
@@ -266,13 +294,14 @@ class PreferencesEditor(Controller):
         if id == -1:
             return False #ignoring unsorted category
 
-        #look for dupes
-        categories = runtime.storage.get_categories()
-        for category in categories:
-            if category['name'].lower() == new_text.lower():
+        #look for dupes, among the categories read already
+        for row in list(self.category_store):
+            if row[0] < 0:
+                continue  # unsorted, or the new one
+            if row[1].lower() == new_text.lower():
                 if id == -2: # that was a new category
                     self.category_store.remove(model.get_iter(path))
-                self.select_category(category['id'])
+                self.select_category(row[0])
                 return False
 
         if id == -2: #new category
@@ -288,18 +317,16 @@ class PreferencesEditor(Controller):
         id = model[path][0]
         category_id = model[path][2]
 
-        activities = runtime.storage.get_category_activities(category_id)
-        prev = None
-        for activity in activities:
-            if id == activity['id']:
-                prev = activity['name']
-            else:
-                # avoid two activities in same category with same name
-                if activity['name'].lower() == new_text.lower():
-                    if id == -1: # that was a new activity
-                        self.activity_store.remove(model.get_iter(path))
-                    self.select_activity(activity['id'])
-                    return False
+        # the activities of the category are the ones listed
+        for row in list(model):
+            if row[0] in (id, -1):
+                continue
+            # avoid two activities in same category with same name
+            if row[1].lower() == new_text.lower():
+                if id == -1: # that was a new activity
+                    self.activity_store.remove(model.get_iter(path))
+                self.select_activity(row[0])
+                return False
 
         if id == -1: #new activity -> add
             model[path][0] = runtime.storage.add_activity(new_text, category_id)
@@ -23,7 +23,6 @@ import os, sys
 import datetime as dt
 from xml.dom.minidom import Document
 import csv
-import copy
 import itertools
 import re
 import codecs
@@ -33,13 +32,12 @@ from textwrap import dedent
 from calendar import timegm
 from io import StringIO, IOBase
 
-from hamster_lite.lib.runtime import runtime
 from hamster_lite.lib import stuff
 from hamster_lite.lib.i18n import C_
 
 
 def simple(facts, start_date, end_date, format, path = None):
-    facts = copy.deepcopy(facts) # dont want to do anything bad to the input
+    """Write facts (any iterable, consumed once) in the given format."""
     report_path = stuff.locale_from_utf8(path)
 
     if format == "tsv":
@@ -66,12 +64,13 @@ class ReportWriter(object):
     def write_report(self, facts):
         try:
             for fact in facts:
-                fact.description = (fact.description or "")
-                fact.category = (fact.category or _("Unsorted"))
+                if not fact.category:
+                    # dont want to do anything bad to the input
+                    fact = fact.copy(category=_("Unsorted"))
 
                 self._write_fact(fact)
 
-            self._finish(facts)
+            self._finish()
         finally:
             if not self.path:
                 # print the full report to stdout
@@ -84,7 +83,7 @@ class ReportWriter(object):
     def _write_fact(self, fact):
         raise NotImplementedError
 
-    def _finish(self, facts):
+    def _finish(self):
         raise NotImplementedError
 
 
@@ -99,21 +98,22 @@ class ICalWriter(ReportWriter):
         #for now we will skip ongoing facts
         if not fact.end_time: return
 
-        if fact.category == _("Unsorted"):
-            fact.category = None
+        category = fact.category
+        if category == _("Unsorted"):
+            category = ""
 
         event_str = """\
                     BEGIN:VEVENT
-                    CATEGORIES:{fact.category}
+                    CATEGORIES:{category}
                     DTSTART:{fact.start_time}
                     DTEND:{fact.end_time}
                     SUMMARY:{fact.activity}
                     DESCRIPTION:{fact.description}
                     END:VEVENT
-                    """.format(fact=fact)
+                    """.format(fact=fact, category=category)
         self.file.write(dedent(event_str))
 
-    def _finish(self, facts):
+    def _finish(self):
         self.file.write("END:VCALENDAR\n")
 
 
@@ -146,7 +146,8 @@ class TSVWriter(ReportWriter):
                                   fact.category,
                                   fact.description,
                                   ", ".join(fact.tags)])
-    def _finish(self, facts):
+
+    def _finish(self):
         pass
 
 class XMLWriter(ReportWriter):
@@ -166,7 +167,7 @@ class XMLWriter(ReportWriter):
         activity.setAttribute("tags", ", ".join(fact.tags))
         self.activity_list.appendChild(activity)
 
-    def _finish(self, facts):
+    def _finish(self):
         self.doc.appendChild(self.activity_list)
         self.file.write(self.doc.toxml())
 
@@ -191,11 +192,15 @@ class HTMLWriter(ReportWriter):
 
 
         # read the template, allow override
-        self.override = os.path.exists(os.path.join(runtime.home_data_dir, "report_template.html"))
+        self.data_dir = stuff.data_dir()
+        self.home_data_dir = os.path.realpath(
+            os.path.join(stuff.user_data_dir(), "hamster-lite"))
+        self.override = os.path.exists(
+            os.path.join(self.home_data_dir, "report_template.html"))
         if self.override:
-            template = os.path.join(runtime.home_data_dir, "report_template.html")
+            template = os.path.join(self.home_data_dir, "report_template.html")
         else:
-            template = os.path.join(runtime.data_dir, "report_template.html")
+            template = os.path.join(self.data_dir, "report_template.html")
 
         self.main_template = ""
         with open(template, 'r') as f:
@@ -209,6 +214,7 @@ class HTMLWriter(ReportWriter):
         self.by_date_template = self._extract_template('by_date')
 
         self.fact_rows = []
+        self.fact_dicts = []  # (date, fact dict) for the json data
 
     def _extract_template(self, name):
         pattern = re.compile('<%s>(.*)</%s>' % (name, name), re.DOTALL)
@@ -254,18 +260,19 @@ class HTMLWriter(ReportWriter):
             description = fact.description or ""
         )
         self.fact_rows.append(Template(self.fact_row_template).safe_substitute(data))
+        self.fact_dicts.append((fact.date, fact.as_dict()))
 
-
-    def _finish(self, facts):
+    def _finish(self):
 
         # group by date
         by_date = []
-        for date, date_facts in itertools.groupby(facts, lambda fact:fact.date):
-            by_date.append((date, [fact.as_dict() for fact in date_facts]))
+        for date, date_facts in itertools.groupby(self.fact_dicts,
+                                                  lambda pair: pair[0]):
+            by_date.append((date, [fact for _, fact in date_facts]))
         by_date = dict(by_date)
 
         date_facts = []
-        date = min(by_date.keys())
+        date = min(by_date.keys(), default=self.start_date)
         while date <= self.end_date:
             str_date = date.strftime(
                         # date column format for each row in HTML report
@@ -297,13 +304,13 @@ class HTMLWriter(ReportWriter):
             header_duration = _("Duration"),
             header_description = _("Description"),
 
-            data_dir = runtime.data_dir,
+            data_dir = self.data_dir,
             show_template = _("Show template"),
-            template_instructions = _("You can override it by storing your version in %(home_folder)s") % {'home_folder': runtime.home_data_dir},
+            template_instructions = _("You can override it by storing your version in %(home_folder)s") % {'home_folder': self.home_data_dir},
 
             start_date = timegm(self.start_date.timetuple()),
             end_date = timegm(self.end_date.timetuple()),
-            facts = json.dumps([fact.as_dict() for fact in facts]),
+            facts = json.dumps([fact for _, fact in self.fact_dicts]),
             date_facts = json.dumps(date_facts),
 
             all_activities_rows = "\n".join(self.fact_rows)
@@ -25,20 +25,330 @@ import logging
 logger = logging.getLogger(__name__)   # noqa: E402
 
 import os
+import atexit
+import calendar
 import datetime
-import itertools
+import json
+import re
 import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from shutil import copy as copyfile
 import datetime as dt
-from gi.repository import GObject as gobject
 from hamster_lite.lib import Fact
 from hamster_lite.lib.configuration import conf
-from hamster_lite.lib.stuff import hamster_today, hamster_now
+from hamster_lite.lib.stuff import (
+    datetime_to_hamsterday, hamster_today, hamster_now, user_data_dir)
+from hamster_lite.lib.stuff import data_dir as shipped_data_dir
+
+
+# enough for every distinct query we run, so none gets parsed twice
+STATEMENT_CACHE_SIZE = 256
+
+# WAL lets readers carry on while we write, and with synchronous=NORMAL
+# a commit no longer waits on fsync, only checkpoints do
+CONNECTION_PRAGMAS = (
+    "journal_mode = WAL",
+    "synchronous = NORMAL",
+    "cache_size = -8000",  # KiB, so 8 MiB
+    "mmap_size = 67108864",
+    "temp_store = MEMORY",
+)
+
+
+# dump the query statistics of the process here on exit, if set
+STATS_ENV = "HAMSTER_LITE_DB_STATS"
+
+
+# rows of fact_changes kept, for the other connections to catch up on
+FACT_CHANGES_KEPT = 1000
+
+
+def _minute(time):
+    """minutes since the epoch, as counted in the fact_intervals index"""
+    return calendar.timegm(time.timetuple()) // 60
+
+
+class QueryStats(object):
+    """Calls, time taken and rows of the statements run, per statement
+    shape: the SQL with its whitespace squeezed, its literals replaced by
+    "?" and lists of "?" in brackets folded, so IN lists of any length
+    and values written into the SQL count as one.
+
+    Shared by the storages of the process, see query_stats. Statements
+    slower than slow_ms are logged as warnings.
+    """
+    SAMPLES = 1000  # latest latencies kept per shape, for percentiles
+    SHAPES = 256  # most recent queries whose shape is remembered
+
+    def __init__(self, slow_ms=None):
+        self.slow_ms = slow_ms
+        self._lock = threading.Lock()
+        self._shapes = OrderedDict()  # query -> shape
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._statements = {}  # shape -> [calls, seconds, rows, samples]
+            self._transactions = [0, 0.0, deque(maxlen=self.SAMPLES)]
+
+    @staticmethod
+    def _shape_of(query):
+        shape = " ".join(query.split())
+        shape = re.sub(r"'(?:[^']|'')*'", "?", shape)
+        shape = re.sub(r"\b\d+(\.\d+)?\b", "?", shape)
+        shape = re.sub(r"\(\?(\s*,\s*\?)*\)", "(?, ...)", shape)
+        # rows of VALUES
+        return re.sub(r"\(\?, \.\.\.\)(\s*,\s*\(\?, \.\.\.\))+",
+                      "(?, ...), ...", shape)
+
+    def _shape(self, query):
+        with self._lock:
+            shape = self._shapes.get(query)
+            if shape is not None:
+                self._shapes.move_to_end(query)
+                return shape
+        shape = self._shape_of(query)
+        with self._lock:
+            self._shapes[query] = shape
+            while len(self._shapes) > self.SHAPES:
+                self._shapes.popitem(last=False)
+        return shape
+
+    def record(self, query, seconds, rows=0):
+        shape = self._shape(query)
+        with self._lock:
+            stats = self._statements.get(shape)
+            if stats is None:
+                stats = self._statements[shape] = \
+                    [0, 0.0, 0, deque(maxlen=self.SAMPLES)]
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] += rows
+            stats[3].append(seconds)
+        if self.slow_ms is not None and seconds * 1000 >= self.slow_ms:
+            logger.warning("slow query, %.1f ms: %s"
+                           % (seconds * 1000, shape[:200]))
+
+    def record_transaction(self, seconds):
+        with self._lock:
+            self._transactions[0] += 1
+            self._transactions[1] += seconds
+            self._transactions[2].append(seconds)
+
+    @staticmethod
+    def _times(calls, seconds, samples):
+        samples = sorted(samples)
+
+        def percentile(p):
+            return samples[min(len(samples) - 1, int(p * len(samples)))] * 1000
+        return {"calls": calls,
+                "total_ms": seconds * 1000,
+                "p50_ms": percentile(0.50) if samples else 0,
+                "p95_ms": percentile(0.95) if samples else 0,
+                "p99_ms": percentile(0.99) if samples else 0}
+
+    def summary(self):
+        """the numbers so far, statements taking the most time first"""
+        with self._lock:
+            statements = [dict(self._times(calls, seconds, samples),
+                               statement=shape, rows=rows)
+                          for shape, (calls, seconds, rows, samples)
+                          in self._statements.items()]
+            transactions = self._times(*self._transactions)
+        statements.sort(key=lambda stats: stats["total_ms"], reverse=True)
+        return {"statements": statements, "transactions": transactions}
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=4)
+
+
+# slow query logging is for looking into performance, so off by default
+query_stats = QueryStats(conf.get("slow_query_ms"))
+
+
+@atexit.register
+def _dump_query_stats():
+    path = os.environ.get(STATS_ENV)
+    if path and query_stats.summary()["statements"]:
+        query_stats.dump(path)
+
+
+class Signals(object):
+    """Minimal signal emitter, connect/disconnect/emit as in GObject.
+
+    Callbacks get the emitter as first argument, followed by the emitted
+    values and any extra arguments given to connect.
+    """
+    signals = ()
+
+    def __init__(self):
+        self._handlers = {}  # handler id -> (signal name, callback, args)
+        self._last_handler_id = 0
+
+    def connect(self, name, callback, *args):
+        if name not in self.signals:
+            raise TypeError("unknown signal name: {}".format(name))
+        self._last_handler_id += 1
+        self._handlers[self._last_handler_id] = (name, callback, args)
+        return self._last_handler_id
+
+    def disconnect(self, handler_id):
+        self._handlers.pop(handler_id, None)
+
+    def emit(self, name, *values):
+        for signal, callback, args in list(self._handlers.values()):
+            if signal == name:
+                callback(self, *(values + args))
+
+
+_storages = {}
+
+
+def get_storage(database_dir=None):
+    """Return the storage of this process for database_dir, creating it
+    on first use.
+
+    Everything in the process should go through here, so the migrations
+    run once and all parts share a connection and the facts-changed
+    signal.
+    """
+    key = os.path.realpath(database_dir) if database_dir else None
+    if key not in _storages:
+        _storages[key] = Storage(database_dir=database_dir)
+    return _storages[key]
+
+
+class StorageExecutor(object):
+    """Run storage calls on a thread of its own, off the GTK main loop.
+
+    The thread opens a second connection to the database of storage, as
+    sqlite connections stay with the thread that made them; under WAL its
+    reads don't wait for our writes. Calls queue up and run one at a time.
+
+    submit(func, *args) runs func(thread_storage, *args) there, so any
+    Storage method can be passed unbound, eg. submit(Storage.get_facts,
+    start, end). It returns a concurrent.futures.Future. A callback gets
+    the result through deliver(callback, result) - pass GLib.idle_add to
+    have it run in the main loop. Failed calls are logged and skip the
+    callback.
+    """
+    def __init__(self, storage):
+        self.database_dir = os.path.dirname(storage.db_path)
+        self.unsorted = storage._unsorted
+        self._storage = None  # made on the worker thread
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="hamster-storage")
+
+    def submit(self, func, *args, callback=None, deliver=None, **kwargs):
+        future = self._executor.submit(self._run, func, args, kwargs)
+        if callback:
+            future.add_done_callback(
+                lambda future: self._done(future, callback, deliver))
+        return future
+
+    def _run(self, func, args, kwargs):
+        if self._storage is None:
+            self._storage = Storage(self.unsorted, self.database_dir)
+        else:
+            self._storage._check_data_version()
+        return func(self._storage, *args, **kwargs)
+
+    def _done(self, future, callback, deliver):
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error:
+            logger.error("storage call failed", exc_info=error)
+            return
+        if deliver:
+            deliver(callback, future.result())
+        else:
+            callback(future.result())
+
+    def shutdown(self):
+        """drop the queued calls, the one running is left to finish"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_executors = {}
+
+
+def get_executor(database_dir=None):
+    """Return the StorageExecutor of this process for database_dir."""
+    key = os.path.realpath(database_dir) if database_dir else None
+    if key not in _executors:
+        _executors[key] = StorageExecutor(get_storage(database_dir))
+    return _executors[key]
+
 
+class RangeCache(object):
+    """The last few get_facts results, by (date, end_date, search_terms).
 
-class Storage(gobject.GObject):
+    Entries are dropped as the range-changed signal of storage reports
+    changes within their range. As results may come from another thread,
+    put only takes them if nothing changed since generation was read.
+    """
+    def __init__(self, storage, size=16):
+        self.size = size
+        self.generation = 0  # goes up with each change
+        self._facts = OrderedDict()
+        storage.connect("range-changed", self.on_range_changed)
 
-    __gsignals__ = {"facts-changed": (gobject.SIGNAL_RUN_LAST, None, ())}
+    def get(self, key):
+        facts = self._facts.get(key)
+        if facts is not None:
+            self._facts.move_to_end(key)
+        return facts
+
+    def put(self, key, facts, generation):
+        if generation != self.generation:
+            return  # read before a change, may be out of date
+        self._facts[key] = facts
+        self._facts.move_to_end(key)
+        while len(self._facts) > self.size:
+            self._facts.popitem(last=False)
+
+    def fetch(self, executor, key, func=None, *args, callback=None,
+              deliver=None):
+        """Have executor run func(storage, *args), by default get_facts for
+        key, keep the facts it returns under key and pass them on to
+        callback. deliver should bring them to the thread using the cache.
+        Returns the future from executor.submit.
+        """
+        if func is None:
+            func, args = Storage.get_facts, key
+        generation = self.generation
+
+        def on_found(facts):
+            self.put(key, facts, generation)
+            if callback:
+                callback(facts)
+        return executor.submit(func, *args, callback=on_found,
+                               deliver=deliver)
+
+    def on_range_changed(self, storage, start_time, end_time):
+        self.generation += 1
+        split_time = conf.day_start
+        for key in list(self._facts):
+            date, end_date = key[0], key[1] or key[0]
+            # the times get_facts looks at for the range
+            start = dt.datetime.combine(date, split_time)
+            end = dt.datetime.combine(end_date, split_time) \
+                + dt.timedelta(days=1)
+            if start_time < end and (end_time is None or end_time >= start):
+                del self._facts[key]
+
+
+class Storage(Signals):
+
+    # range-changed (start_time, end_time) comes right before
+    # facts-changed, with the span of the facts changed; end_time is None
+    # when that reaches an ongoing fact
+    signals = ("facts-changed", "range-changed")
 
     con = None  # Connection will be created on demand
 
@@ -46,22 +356,32 @@ class Storage(gobject.GObject):
         """
         Delayed setup so we don't do everything at the same time (?)
         """
-        gobject.GObject.__init__(self)
+        Signals.__init__(self)
 
         self._unsorted = unsorted  # NB. pass in localized name
 
-        self.__con = None
         self.__cur = None
+        self.__transaction = 0  # depth of start_transaction calls
+        self.__failed = False  # a nested transaction was rolled back
+        self.__pending = []  # signals held back until the commit
+        self.__transaction_start = None  # perf_counter of the outermost
+
+        self.stats = query_stats
+
+        self._caches = {}
+        self._data_version = None
 
         self.db_path = self.__init_db_file(database_dir)
         logger.info("database: '{}'".format(self.db_path))
 
         self.run_fixtures()
+        last = self.fetchone("SELECT max(id) FROM fact_changes")[0]
+        self._seen_change = last or 0  # last fact_changes id we reported
+        self._checked_version = self._check_data_version()
 
     def __init_db_file(self, database_dir):
+        xdg_data_home = user_data_dir()
         if not database_dir:
-            from gi.repository import GLib
-            xdg_data_home = GLib.get_user_data_dir()
             database_dir = os.path.join(xdg_data_home, 'hamster-lite')
 
         if not os.path.exists(database_dir):
@@ -79,19 +399,7 @@ class Storage(gobject.GObject):
                 os.link(old_db_path, db_path)
             else:
                 # make a copy of the empty template hamster.db
-                try:
-                    from hamster import defs  # noqa:
-                    data_dir = os.path.join(defs.DATA_DIR, "hamster-lite")
-                except ImportError:
-                    # if defs is not there, we are running from sources
-                    module_dir = os.path.dirname(os.path.realpath(__file__))
-                    if os.path.exists(os.path.join(module_dir, "data")):
-                        # running as flask app. XXX - detangle
-                        data_dir = os.path.join(module_dir, "data")
-                    else:
-                        # get ./data from ./src/hamster_lite/storage/db.py
-                        data_dir = os.path.join(module_dir,
-                                                '..', '..', '..', 'data')
+                data_dir = shipped_data_dir()
                 logger.warning("Database not found in %s"
                                " - installing default from %s!"
                                % (db_path, data_dir))
@@ -108,20 +416,28 @@ class Storage(gobject.GObject):
 
     def update_fact(self, fact_id, fact, temporary=False):
         self.start_transaction()
-        self._remove_fact(fact_id)
-        result = self.add_fact(fact)
+        try:
+            self._remove_fact(fact_id)
+            result = self.add_fact(fact)
+            self.emit("facts-changed")
+        except BaseException:
+            self.rollback_transaction()
+            raise
         self.end_transaction()
-        self.emit("facts-changed")
         return result
 
     def remove_fact(self, fact_id):
         """Remove fact from storage by it's ID"""
         self.start_transaction()
-        fact = self.get_fact(fact_id)
-        if fact:
-            self._remove_fact(fact_id)
+        try:
+            fact = self.get_fact(fact_id)
+            if fact:
+                self._remove_fact(fact_id)
+            self.emit("facts-changed")
+        except BaseException:
+            self.rollback_transaction()
+            raise
         self.end_transaction()
-        self.emit("facts-changed")
 
     def stop_tracking(self, end_time=None):
         """Stops tracking the current activity"""
@@ -152,9 +468,8 @@ class Storage(gobject.GObject):
     def _get_tag_ids(self, tags):
         """look up tags by their name. create if not found"""
 
-        # bit of magic here - using sqlites bind variables
-        db_tags = self.fetchall("select * from tags where name in (%s)"
-                                % ",".join(["?"] * len(tags)), tags)
+        cached = self._cached("tags")
+        db_tags = [cached[tag] for tag in dict.fromkeys(tags) if tag in cached]
 
         changes = False
 
@@ -165,6 +480,7 @@ class Storage(gobject.GObject):
             changes = True
             query = "update tags set autocomplete='true' where id in (%s)"
             self.execute(query % ", ".join(set_complete))
+            self._clear_caches()
 
         found_tags = [tag["name"] for tag in db_tags]
 
@@ -172,6 +488,7 @@ class Storage(gobject.GObject):
         if add:
             statement = "insert into tags(name) values(?)"
             self.execute([statement] * len(add), [(tag,) for tag in add])
+            self._clear_caches()
             return self._get_tag_ids(tags)[0], True  # all done, recurse
         else:
             return db_tags, changes
@@ -210,6 +527,7 @@ class Storage(gobject.GObject):
                 "update tags set autocomplete='false' where id in (%s)"
                 % ", ".join(to_uncomplete)
             )
+        self._clear_caches()
         return changes or len(to_delete + to_uncomplete) > 0
 
     def get_categories(self):
@@ -225,10 +543,8 @@ class Storage(gobject.GObject):
                      WHERE id = ?
         """
         self.execute(query, (name, name.lower(), category_id, id))
-
-        query = "select id from facts where activity_id = ?"
-        affected_ids = [res[0] for res in self.fetchall(query, (id,))]
-        self._remove_index(affected_ids)
+        self._clear_caches()
+        self.emit("facts-changed")
 
     def change_category(self, id, category_id):
         # first check if we don't have an activity with same name before us
@@ -262,14 +578,9 @@ class Storage(gobject.GObject):
             """
 
             self.execute(statement, (category_id, id))
+            self._clear_caches()
 
-        query = "select id from facts where activity_id = ?"
-        affected_ids = [res[0] for res in self.fetchall(query, (id,))]
-        if existing_activity:
-            affected_ids.extend([res[0] for res in self.fetchall(
-                query, (existing_activity['id'],))])
-        self._remove_index(affected_ids)
-
+        self.emit("facts-changed")
         return True
 
     def add_category(self, name):
@@ -278,6 +589,7 @@ class Storage(gobject.GObject):
                         VALUES (?, ?)
         """
         self.execute(query, (name, name.lower()))
+        self._clear_caches()
         return self._last_insert_rowid()
 
     def update_category(self, id, name):
@@ -289,41 +601,12 @@ class Storage(gobject.GObject):
                          WHERE id = ?
             """
             self.execute(update, (name, name.lower(), id))
-
-        affected_query = """
-          SELECT id
-            FROM facts
-           WHERE activity_id in (SELECT id FROM activities where category_id=?)
-        """
-        affected_ids = [res[0] for res in self.fetchall(affected_query, (id,))]
-        self._remove_index(affected_ids)
+            self._clear_caches()
+            self.emit("facts-changed")
 
     def get_activity_by_name(self, activity, category_id=None, resurrect=True):
         """get most recent, preferably not deleted activity by it's name"""
-
-        if category_id:
-            query = """
-               SELECT a.id, a.name, a.deleted, coalesce(b.name, ?) as category
-                 FROM activities a
-            LEFT JOIN categories b ON category_id = b.id
-                WHERE lower(a.name) = lower(?)
-                  AND category_id = ?
-             ORDER BY a.deleted, a.id desc
-                LIMIT 1
-            """
-            res = self.fetchone(query, (self._unsorted, activity, category_id))
-        elif activity:
-            query = """
-               SELECT a.id, a.name, a.deleted, coalesce(b.name, ?) as category
-                 FROM activities a
-            LEFT JOIN categories b ON category_id = b.id
-                WHERE lower(a.name) = lower(?)
-             ORDER BY a.deleted, a.id desc
-                LIMIT 1
-            """
-            res = self.fetchone(query, (self._unsorted, activity, ))
-        else:
-            res = None
+        res = self._find_activity(activity, category_id) if activity else None
 
         if res:
             keys = ('id', 'name', 'deleted', 'category')
@@ -339,48 +622,96 @@ class Storage(gobject.GObject):
                              WHERE id = ?
                         """
                 self.execute(update, (res['id'], ))
+                self._clear_caches()
 
             return res
 
         return {}
 
+    def _find_activity(self, name, category_id=None):
+        """the cached activity row for get_activity_by_name, or None"""
+        activities = self._cached("activities").get(name.lower(), [])
+        if category_id:
+            activities = [activity for activity in activities
+                          if activity["category_id"] == category_id]
+        return activities[0] if activities else None
+
     def get_category_id(self, name):
         """returns category by it's name"""
         if not name:
             return -1
 
+        return self._cached("categories").get(name.lower())
+
+    # activities, categories and tags are few and rarely change, so they
+    # are kept in memory. methods changing them call _clear_caches, and
+    # changes committed by other processes show in PRAGMA data_version,
+    # looked at when a transaction starts and on every check_changes
+    def _cached(self, name):
+        if name not in self._caches:
+            self._caches[name] = getattr(self, "_load_" + name)()
+        return self._caches[name]
+
+    def _clear_caches(self):
+        self._caches = {}
+
+    def _check_data_version(self):
+        """drop the caches if another connection committed since the last
+        look, and return the current data version"""
+        data_version = self.fetchone("PRAGMA data_version")[0]
+        if data_version != self._data_version:
+            self._clear_caches()
+            self._data_version = data_version
+        return data_version
+
+    def _load_activities(self):
+        """lowercased name -> activity rows, best match first"""
         query = """
-                   SELECT id from categories
-                    WHERE lower(name) = lower(?)
-                 ORDER BY id desc
-                    LIMIT 1
+                   SELECT a.id, a.name, a.deleted, a.category_id,
+                          coalesce(b.name, ?) as category
+                     FROM activities a
+                LEFT JOIN categories b ON category_id = b.id
+                 ORDER BY a.deleted, a.id desc
         """
+        activities = {}
+        for row in self.fetchall(query, (self._unsorted,)):
+            activities.setdefault(row["name"].lower(), []).append(row)
+        return activities
 
-        res = self.fetchone(query, (name, ))
+    def _load_categories(self):
+        """lowercased name -> category id, the newest for duplicates"""
+        query = "SELECT id, name FROM categories ORDER BY id"
+        return {row["name"].lower(): row["id"]
+                for row in self.fetchall(query)}
 
-        if res:
-            return res['id']
+    def _load_tags(self):
+        """name -> tag row"""
+        return {row["name"]: row
+                for row in self.fetchall("select * from tags")}
+
+    # one row per fact, with the tag names joined by TAG_SEPARATOR
+    # (tags cannot contain control characters, see lib.tag_re)
+    TAG_SEPARATOR = "\x1f"
 
-        return None
+    fact_query = """
+           SELECT a.id AS id,
+                  a.start_time AS start_time,
+                  a.end_time AS end_time,
+                  a.description as description,
+                  b.name AS activity, b.id as activity_id,
+                  coalesce(c.name, ?) as category,
+                  coalesce(c.id, -1) as category_id,
+                  (SELECT group_concat(e.name, char(31))
+                     FROM fact_tags d
+                     JOIN tags e ON e.id = d.tag_id
+                    WHERE d.fact_id = a.id) as tags
+             FROM facts a
+        LEFT JOIN activities b ON a.activity_id = b.id
+        LEFT JOIN categories c ON b.category_id = c.id
+    """
 
     def get_fact(self, id):
-        query = """
-                   SELECT a.id AS id,
-                          a.start_time AS start_time,
-                          a.end_time AS end_time,
-                          a.description as description,
-                          b.name AS activity, b.id as activity_id,
-                          coalesce(c.name, ?) as category,
-                          coalesce(c.id, -1) as category_id,
-                          e.name as tag
-                     FROM facts a
-                LEFT JOIN activities b ON a.activity_id = b.id
-                LEFT JOIN categories c ON b.category_id = c.id
-                LEFT JOIN fact_tags d ON d.fact_id = a.id
-                LEFT JOIN tags e ON e.id = d.tag_id
-                    WHERE a.id = ?
-                 ORDER BY e.name
-        """
+        query = self.fact_query + " WHERE a.id = ?"
 
         rows = self.fetchall(query, (self._unsorted, id))
         assert len(rows) > 0, "No fact with id {}".format(id)
@@ -388,23 +719,21 @@ class Storage(gobject.GObject):
         logger.info("got fact {}".format(fact))
         return fact
 
-    def _create_facts(self, fact_dicts):
-        """Create Fact instances, moving all tags to an array"""
-        if not fact_dicts:
-            return fact_dicts  # be it None or whatever
+    def _create_facts(self, fact_rows):
+        """Create Fact instances from fact_query rows"""
+        if not fact_rows:
+            return fact_rows  # be it None or whatever
 
-        facts = []
-        for fact_id, fact_tags in \
-                itertools.groupby(fact_dicts, lambda f: f["id"]):
-            fact_tags = list(fact_tags)
+        return [self._fact_from_row(row) for row in fact_rows]
 
-            # first one is as good as the last one: convert to Fact
-            grouped_fact = dict(**fact_tags[0])
-            grouped_fact['tags'] = [f['tag'] for f in fact_tags if f['tag']]
-            grouped_fact.pop('tag')
-
-            facts.append(Fact(**grouped_fact))
-        return facts
+    def _fact_from_row(self, row):
+        (id, start_time, end_time, description, activity, activity_id,
+         category, category_id, tags) = row
+        tags = sorted(tags.split(self.TAG_SEPARATOR)) if tags else []
+        return Fact(activity=activity, category=category,
+                    description=description, tags=tags,
+                    start_time=start_time, end_time=end_time, id=id,
+                    activity_id=activity_id, category_id=category_id)
 
     def _touch_fact(self, fact, end_time=None):
         end_time = end_time or hamster_now()
@@ -419,7 +748,39 @@ class Storage(gobject.GObject):
             """
             self.execute(query, (end_time, fact.id))
 
-    def _squeeze_in(self, start_time):
+    def get_overlap_changes(self, start_time, end_time=None,
+                            exclude_id=None):
+        """Work out what adding a fact from start_time to end_time does to
+        the facts around it, without changing anything.
+
+        Returns the end time the new fact gets, and a list of
+        (fact, new_fact) pairs: the facts that change, each with a copy
+        carrying its new times. A fact that gets split appears twice,
+        the copy for its tail has no id. exclude_id leaves out the fact
+        being edited.
+        """
+        if end_time:
+            until = end_time
+        else:
+            # an ongoing fact runs until the next one, within a few hours
+            until = start_time + dt.timedelta(hours=12)
+
+        # the interval index is in whole minutes, so leave a minute of slack
+        query = self.fact_query + """
+             JOIN fact_intervals r ON r.id = a.id
+            WHERE r.start_minute <= ? AND r.end_minute >= ?
+         ORDER BY a.start_time
+        """
+        facts = [fact for fact in map(self._fact_from_row, self.fetchall(
+                     query, (self._unsorted, _minute(until) + 1,
+                             _minute(start_time) - 1)))
+                 if fact.id != exclude_id]
+
+        if not end_time:
+            return self._squeeze_in(start_time, facts)
+        return end_time, self._solve_overlaps(start_time, end_time, facts)
+
+    def _squeeze_in(self, start_time, facts):
         """ tries to put task in the given date
             if there are conflicts, we will only truncate the ongoing task
             and replace it's end part with our activity """
@@ -428,60 +789,40 @@ class Storage(gobject.GObject):
         # or maybe there is something after us - so we know to adjust end time
         # in the latter case go only few hours ahead. everything else
         # is madness, heh
-        query = """
-           SELECT a.*, b.name
-             FROM facts a
-        LEFT JOIN activities b on b.id = a.activity_id
-            WHERE ((start_time < ? and end_time > ?)
-                   OR (start_time > ? and start_time < ? and end_time is null)
-                   OR (start_time > ? and start_time < ?))
-         ORDER BY start_time
-            LIMIT 1
-        """
-        row = self.fetchone(query, (start_time, start_time,
-                                    start_time - dt.timedelta(hours=12),
-                                    start_time, start_time,
-                                    start_time + dt.timedelta(hours=12)))
-        end_time = None
-        if row:
-            if start_time > row['start_time']:
-                # we are in middle of a fact - truncate it to our start
-                self.execute("UPDATE facts SET end_time=? WHERE id=?",
-                             (start_time, row['id']))
-
-            else:  # otherwise we have found a task that is after us
-                end_time = row['start_time']
+        for fact in facts:
+            if (fact.start_time < start_time
+                    and fact.end_time and fact.end_time > start_time) \
+               or (start_time - dt.timedelta(hours=12) < fact.start_time
+                   < start_time and not fact.end_time) \
+               or (start_time < fact.start_time
+                   < start_time + dt.timedelta(hours=12)):  # noqa: W503
+                break
+        else:
+            return None, []
 
-        return end_time
+        if start_time > fact.start_time:
+            # we are in middle of a fact - truncate it to our start
+            return None, [(fact, fact.copy(end_time=start_time))]
+        else:  # otherwise we have found a task that is after us
+            return fact.start_time, []
 
-    def _solve_overlaps(self, start_time, end_time):
+    def _solve_overlaps(self, start_time, end_time, facts):
         """finds facts that happen in given interval and shifts them to
         make room for new fact
         """
-        if end_time is None or start_time is None:
-            return
-
         # possible combinations and the OR clauses that catch them
         # (the side of the number marks if it catches the end or start time)
         #             |----------------- NEW -----------------|
         #      |--- old --- 1|   |2 --- old --- 1|   |2 --- old ---|
         # |3 -----------------------  big old   ------------------------ 3|
-        query = """
-                   SELECT a.*, b.name as activity, c.name as category
-                     FROM facts a
-                LEFT JOIN activities b on b.id = a.activity_id
-                LEFT JOIN categories c on b.category_id = c.id
-                    WHERE (end_time > ? and end_time < ?)
-                       OR (start_time > ? and start_time < ?)
-                       OR (start_time < ? and end_time > ?)
-                 ORDER BY start_time
-                """
-        conflicts = self.fetchall(query, (start_time, end_time,
-                                          start_time, end_time,
-                                          start_time, end_time))
-
-        for row in conflicts:
-            fact = Fact(**row)
+        changes = []
+        for fact in facts:
+            if not (fact.end_time and start_time < fact.end_time < end_time
+                    or start_time < fact.start_time < end_time
+                    or fact.end_time and fact.start_time < start_time
+                    and fact.end_time > end_time):  # noqa: W503
+                continue
+
             fact_end_time = fact.end_time or hamster_now()
 
             # won't eliminate as it is better to have overlapping entries
@@ -495,36 +836,59 @@ class Storage(gobject.GObject):
                fact.start_time < end_time < fact_end_time:
 
                 logger.info("splitting %s" % fact)
-                # truncate until beginning of the new entry
-                self.execute("""UPDATE facts
-                                   SET end_time = ?
-                                 WHERE id = ?""", (start_time, fact.id))
-
-                # create new fact for the end
-                new_fact = fact.copy()
-                new_fact.end_time = fact_end_time
-                new_fact_id = self.add_fact(new_fact)
-
-                # copy tags
-                tag_update = """INSERT INTO fact_tags(fact_id, tag_id)
-                                     SELECT ?, tag_id
-                                       FROM fact_tags
-                                      WHERE fact_id = ?"""
-                self.execute(tag_update, (new_fact_id, fact.id))
+                changes.append((fact, fact.copy(end_time=start_time)))
+                tail = fact.copy(start_time=end_time, end_time=fact_end_time)
+                tail.id = None
+                changes.append((fact, tail))
 
             # overlap start
             elif start_time < fact.start_time < end_time:
                 logger.info("Overlapping start of %s" % fact)
-                self.execute("UPDATE facts SET start_time=? WHERE id=?",
-                             (end_time, fact.id))
+                changes.append((fact, fact.copy(start_time=end_time)))
 
             # overlap end
             elif start_time < fact_end_time < end_time:
                 logger.info("Overlapping end of %s" % fact)
-                self.execute("UPDATE facts SET end_time=? WHERE id=?",
-                             (start_time, fact.id))
+                changes.append((fact, fact.copy(end_time=start_time)))
+
+        return changes
+
+    def _apply_overlap_changes(self, changes):
+        """write out the changes from get_overlap_changes"""
+        self.executemany("UPDATE facts SET start_time=?, end_time=?"
+                         " WHERE id=?",
+                         [(new.start_time, new.end_time, new.id)
+                          for fact, new in changes if new.id])
+
+        for fact, tail in changes:
+            if tail.id:
+                continue
+            insert = """
+                INSERT INTO facts (activity_id, start_time, end_time,
+                                   description)
+                           VALUES (?, ?, ?, ?)
+            """
+            self.execute(insert, (tail.activity_id, tail.start_time,
+                                  tail.end_time, tail.description))
+            tag_update = """INSERT INTO fact_tags(fact_id, tag_id)
+                                 SELECT ?, tag_id
+                                   FROM fact_tags
+                                  WHERE fact_id = ?"""
+            self.execute(tag_update, (self._last_insert_rowid(), fact.id))
 
     def add_fact(self, fact):
+        # closing and squeezing neighbours, tags and the insert all commit
+        # together
+        self.start_transaction()
+        try:
+            result = self.__add_fact(fact)
+        except BaseException:
+            self.rollback_transaction()
+            raise
+        self.end_transaction()
+        return result
+
+    def __add_fact(self, fact):
 
         logger.info("adding fact {}".format(fact))
 
@@ -600,11 +964,9 @@ class Storage(gobject.GObject):
 
         #
         # done with the current activity, now we can solve overlaps
-        end_time = fact.end_time
-        if not end_time:
-            end_time = self._squeeze_in(start_time)
-        else:
-            self._solve_overlaps(start_time, end_time)
+        end_time, changes = self.get_overlap_changes(start_time,
+                                                     fact.end_time)
+        self._apply_overlap_changes(changes)
 
         #
         # finally add the new entry
@@ -622,12 +984,177 @@ class Storage(gobject.GObject):
         params = [(fact_id, tag[0]) for tag in tags]
         self.execute([insert] * len(tags), params)
 
-        self._remove_index([fact_id])
-
         logger.info("fact successfully added, with id #{}".format(fact_id))
         self.emit("facts-changed")
         return fact_id
 
+    def add_facts(self, facts, policy="keep"):
+        """Add many facts at once, as for an import.
+
+        Unlike add_fact, this does not close the ongoing fact or
+        restart it. Names are resolved in a few set based queries, and
+        everything is written in a single transaction with one
+        facts-changed signal at the end. Overlaps are settled by policy:
+
+          keep - add the facts as they are
+          skip - leave out facts that overlap an existing fact or an
+                 earlier one of the batch
+          trim - cut facts down to the gaps between the existing facts
+                 and the earlier ones of the batch, leaving out what does
+                 not fit
+
+        Existing facts are never changed. Returns the ids of the added
+        facts, in start time order.
+        """
+        if policy not in ("keep", "skip", "trim"):
+            raise ValueError("unknown overlap policy %r" % policy)
+
+        facts = sorted((fact for fact in facts
+                        if fact.activity and fact.start_time is not None),
+                       key=lambda fact: fact.start_time)
+        if not facts:
+            return []
+
+        self.start_transaction()
+        try:
+            if policy == "keep":
+                facts = [(fact.start_time, fact.end_time, fact)
+                         for fact in facts]
+            else:
+                facts = self._fit_facts(facts, policy == "trim")
+
+            category_ids = self._get_category_ids(
+                [fact.category for start, end, fact in facts if fact.category])
+            activities = [
+                (fact.activity, category_ids[fact.category.lower()]
+                 if fact.category else None)
+                for start, end, fact in facts]
+            activity_ids = self._get_activity_ids(activities)
+            tag_ids = {tag["name"]: tag["id"] for tag in self._get_tag_ids(
+                list({tag for start, end, fact in facts
+                      for tag in fact.tags}))[0]}
+
+            rows = []
+            for (start_time, end_time, fact), (name, category_id) in \
+                    zip(facts, activities):
+                activity_id = activity_ids[name.lower(), category_id]
+                rows.append((activity_id, start_time, end_time,
+                             fact.description))
+            self.executemany("""
+                INSERT INTO facts (activity_id, start_time, end_time,
+                                   description)
+                           VALUES (?, ?, ?, ?)
+            """, rows)
+
+            # ids are handed out in order within our transaction
+            last_id = self._last_insert_rowid()
+            fact_ids = list(range(last_id - len(rows) + 1, last_id + 1))
+
+            self.executemany(
+                "insert into fact_tags(fact_id, tag_id) values(?, ?)",
+                [(fact_id, tag_ids[tag])
+                 for fact_id, (start, end, fact) in zip(fact_ids, facts)
+                 for tag in set(fact.tags)])
+        except BaseException:
+            # an import goes in whole or not at all
+            self.rollback_transaction()
+            raise
+        self.end_transaction()
+
+        logger.info("added %d facts" % len(fact_ids))
+        if fact_ids:
+            self.emit("facts-changed")
+        return fact_ids
+
+    def _fit_facts(self, facts, trim):
+        """Sweep the facts, sorted by start time, against the ones in the
+        database and each other. Returns (start_time, end_time, fact) of
+        the facts that fit, trimmed if asked to."""
+        now = hamster_now()
+        first = facts[0].start_time
+        last = max(fact.end_time or max(fact.start_time, now)
+                   for fact in facts)
+
+        query = """
+            SELECT start_time, end_time
+              FROM facts
+             WHERE start_time < ? AND (end_time > ? OR end_time IS NULL)
+          ORDER BY start_time
+        """
+        existing = [(row["start_time"],
+                     row["end_time"] or max(row["start_time"], now))
+                    for row in self.fetchall(query, (last, first))]
+
+        res = []
+        reach = None  # the latest end of everything started so far
+        i = 0
+        for fact in facts:
+            start_time, end_time = fact.start_time, fact.end_time
+            # ongoing facts count as running until now
+            until = end_time or max(start_time, now)
+
+            while i < len(existing) and existing[i][0] <= start_time:
+                reach = max(reach or existing[i][1], existing[i][1])
+                i += 1
+
+            if reach and reach > start_time:
+                if not trim:
+                    continue
+                start_time = reach
+            if i < len(existing) and existing[i][0] < until:
+                if not trim:
+                    continue
+                end_time = until = existing[i][0]
+            if end_time is not None and start_time >= end_time:
+                continue  # nothing left of it
+
+            res.append((start_time, end_time, fact))
+            reach = max(reach or until, until)
+        return res
+
+    def _get_category_ids(self, names):
+        """map the lowercased names to category ids, creating the missing
+        categories"""
+        # the first spelling of a name is the one that gets created
+        names = dict(reversed([(name.lower(), name) for name in names]))
+        missing = [names[name] for name in names
+                   if name not in self._cached("categories")]
+        if missing:
+            self.executemany(
+                "INSERT INTO categories (name, search_name) VALUES (?, ?)",
+                [(name, name.lower()) for name in missing])
+            self._clear_caches()
+        categories = self._cached("categories")
+        return {name: categories[name] for name in names}
+
+    def _get_activity_ids(self, activities):
+        """map (lowercased name, category_id) pairs to activity ids,
+        creating the missing activities and resurrecting deleted ones.
+        As in get_activity_by_name, a category_id of None matches the
+        activity in any category."""
+        activities = dict(reversed([((name.lower(), category_id), name)
+                                    for name, category_id in activities]))
+        missing, resurrect = [], []
+        for (name, category_id), spelling in activities.items():
+            activity = self._find_activity(name, category_id)
+            if not activity:
+                missing.append((spelling, name, category_id or -1))
+            elif activity["deleted"]:
+                resurrect.append((category_id or -1, activity["id"]))
+        if resurrect:
+            self.executemany("""
+                UPDATE activities SET deleted = null, category_id = ?
+                 WHERE id = ?
+            """, resurrect)
+        if missing:
+            self.executemany("""
+                INSERT INTO activities (name, search_name, category_id)
+                     VALUES (?, ?, ?)
+            """, missing)
+        if resurrect or missing:
+            self._clear_caches()
+        return {key: self._find_activity(*key)["id"] for key in activities}
+
     def _last_insert_rowid(self):
         return self.fetchone("SELECT last_insert_rowid();")[0]
 
@@ -637,6 +1164,36 @@ class Storage(gobject.GObject):
         return self.get_facts(hamster_today())
 
     def get_facts(self, date, end_date=None, search_terms=""):
+        return list(self.iter_facts(date, end_date, search_terms))
+
+    def filter_facts(self, facts, search_terms):
+        """The facts out of the given ones that match search_terms, as in
+        get_facts. Cheaper than a new get_facts when narrowing down the
+        results of an earlier search."""
+        reverse = search_terms.lower().startswith("not ")
+        match = self._match_expression(search_terms[4:] if reverse
+                                       else search_terms)
+        if not match:
+            return list(facts)
+        ids = {row[0] for row in self.fetchall(
+            "SELECT rowid FROM fact_index WHERE fact_index MATCH ?", (match,))}
+        return [fact for fact in facts if (fact.id in ids) != reverse]
+
+    def iter_facts(self, date, end_date=None, search_terms=""):
+        """Like get_facts, but yield the facts one at a time as they are
+        read from the database, so long ranges are never all in memory."""
+        where, params = self._facts_filter(date, end_date, search_terms)
+        query = self.fact_query + where + " ORDER BY a.start_time"
+
+        fact_rows = self.fetchiter(query, (self._unsorted,) + params)
+
+        facts = map(self._fact_from_row, fact_rows)
+
+        return self._assign_dates(facts)
+
+    def _facts_filter(self, date, end_date, search_terms):
+        """The WHERE clause and its params picking the facts of the hamster
+        days from date to end_date, for a query over facts a."""
         split_time = conf.day_start
         start = dt.datetime.combine(date, split_time)
 
@@ -646,90 +1203,223 @@ class Storage(gobject.GObject):
 
         logger.info("searching for facts from %s to %s" % (start, end))
 
+        # facts starting more than 30 days before the range are ignored,
+        # which also gives the start_time index a lower bound to seek to
         query = """
-           SELECT a.id AS id,
-                  a.start_time AS start_time,
-                  a.end_time AS end_time,
-                  a.description as description,
-                  b.name AS activity, b.id as activity_id,
-                  coalesce(c.name, ?) as category,
-                  e.name as tag
-             FROM facts a
-        LEFT JOIN activities b ON a.activity_id = b.id
-        LEFT JOIN categories c ON b.category_id = c.id
-        LEFT JOIN fact_tags d ON d.fact_id = a.id
-        LEFT JOIN tags e ON e.id = d.tag_id
-            WHERE (a.end_time >= ? OR a.end_time IS NULL) AND a.start_time <= ?
+            WHERE a.start_time BETWEEN ? AND ?
+              AND (a.end_time >= ? OR a.end_time IS NULL)
         """
 
-        if search_terms:
-            # check if we need changes to the index
-            self._check_index(start, end)
+        params = (start - dt.timedelta(days=30), end, start)
 
-            # flip the query around when it starts with "not "
-            reverse_search_terms = search_terms.lower().startswith("not ")
-            if reverse_search_terms:
-                search_terms = search_terms[4:]
+        # flip the query around when it starts with "not "
+        reverse_search_terms = search_terms.lower().startswith("not ")
+        if reverse_search_terms:
+            search_terms = search_terms[4:]
 
-            search_terms = search_terms.replace('\\', '\\\\')\
-                                       .replace('%', '\\%')\
-                                       .replace('_', '\\_')\
-                                       .replace("'", "''")
-            query += """ AND a.id %s IN (SELECT id
+        match = self._match_expression(search_terms)
+        if match:
+            # fact_index is kept up to date by triggers, see run_fixtures
+            query += """ AND a.id %s IN (SELECT rowid
                                          FROM fact_index
-                                         WHERE fact_index MATCH '%s')
-            """ % ('NOT' if reverse_search_terms else '', search_terms)
+                                         WHERE fact_index MATCH ?)
+            """ % ('NOT' if reverse_search_terms else '')
+            params += (match,)
 
-        query += " ORDER BY a.start_time, e.name"
+        return query, params
 
-        fact_dicts = self.fetchall(query, (self._unsorted, start, end))
+    def get_totals(self, date, end_date=None, group_by="category",
+                   search_terms=""):
+        """Total time of the facts get_facts would return, summed up in
+        the database.
 
-        # put all tags in an array and convert to Fact instances
-        facts = self._create_facts(fact_dicts)
+        group_by is one of "day", "activity", "category" or "tag". Returns
+        (key, timedelta) pairs, longest first. Days are dates, assigned as
+        in get_facts. A fact counts towards each of its tags, facts
+        without tags have None as tag. Ongoing facts count up to now.
+        """
+        keys = {"day": "f.day", "activity": "f.activity",
+                "category": "f.category", "tag": "e.name"}
+        if group_by not in keys:
+            raise ValueError("can not group totals by %r" % group_by)
+
+        split = conf.day_start.hour * 60 + conf.day_start.minute
+        now = hamster_now()
+        where, params = self._facts_filter(date, end_date, search_terms)
+
+        # facts spanning two hamster days go to the one where most of
+        # the fact was done, as in _assign_dates. ongoing facts from
+        # earlier than today or the last 12 hours stay where they started
+        query = """
+            SELECT %s AS key, sum(f.duration) AS duration
+              FROM (SELECT f.*,
+                           CASE WHEN julianday(f.end_day)
+                                     - julianday(f.start_day) = 1
+                                 AND julianday(f.end_day, ?)
+                                     - julianday(f.start_time)
+                                     <= julianday(f.until)
+                                     - julianday(f.end_day, ?)
+                                THEN f.end_day
+                                ELSE f.start_day
+                           END AS day
+                      FROM (SELECT f.*,
+                                   julianday(coalesce(f.end_time, ?))
+                                   - julianday(f.start_time) AS duration,
+                                   date(f.start_time, ?) AS start_day,
+                                   date(f.until, ?) AS end_day
+                              FROM (SELECT a.id, a.start_time, a.end_time,
+                                           b.name AS activity,
+                                           coalesce(c.name, ?) AS category,
+                                           CASE WHEN a.end_time IS NOT NULL
+                                                THEN a.end_time
+                                                WHEN date(a.start_time) = ?
+                                                  OR a.start_time >= ?
+                                                THEN ?
+                                                ELSE a.start_time
+                                           END AS until
+                                      FROM facts a
+                                 LEFT JOIN activities b
+                                           ON a.activity_id = b.id
+                                 LEFT JOIN categories c
+                                           ON b.category_id = c.id
+                                      %s) f) f) f
+        """ % (keys[group_by], where)
+        if group_by == "tag":
+            query += """
+         LEFT JOIN fact_tags d ON d.fact_id = f.id
+         LEFT JOIN tags e ON e.id = d.tag_id
+            """
+        query += " GROUP BY key ORDER BY duration DESC, key"
+
+        offset = "-%d minutes" % split
+        params = ("+%d minutes" % split, "+%d minutes" % split,
+                  now, offset, offset,
+                  self._unsorted, datetime_to_hamsterday(now).isoformat(),
+                  now - dt.timedelta(hours=12), now) + params
+
+        totals = []
+        for row in self.fetchall(query, params):
+            key = row["key"]
+            if group_by == "day":
+                key = dt.date.fromisoformat(key)
+            totals.append((key, dt.timedelta(seconds=round(
+                row["duration"] * 24 * 60 * 60))))
+        return totals
+
+    def _assign_dates(self, facts):
+        """heuristics to assign facts to proper hamster days
+
+        A fact spanning two hamster days goes to the one where most of it
+        was done. Current time and day start are looked up once per call.
+        Facts are yielded as they come in.
+        """
+        split_time = conf.day_start
+        now = hamster_now()
+        today = datetime_to_hamsterday(now)
+        recent = now - dt.timedelta(hours=12)
+        one_day = dt.timedelta(days=1)
 
-        res = []
         for fact in facts:
-            # heuristics to assign tasks to proper days
+            start_time = fact.start_time
 
-            # if fact has no end time, set the last minute of the day,
-            # or current time if fact has happened in last 12 hours
+            # if fact has no end time, use current time if fact has
+            # happened today or in last 12 hours, else leave it where it is
             if fact.end_time:
-                fact_end_time = fact.end_time
-            elif (hamster_today() == fact.start_time.date()) or \
-                 (hamster_now() - fact.start_time) <= dt.timedelta(hours=12):
-                fact_end_time = hamster_now()
-            else:
-                fact_end_time = fact.start_time
-
-            fact_start_date = fact.start_time.date() \
-                - dt.timedelta(1 if fact.start_time.time() < split_time else 0)
-            fact_end_date = fact_end_time.date() \
-                - dt.timedelta(1 if fact_end_time.time() < split_time else 0)
-            fact_date_span = fact_end_date - fact_start_date
-
-            # check if the task spans across two dates
-            if fact_date_span.days == 1:
-                datetime_split = dt.datetime.combine(fact_end_date, split_time)
-                start_date_duration = datetime_split - fact.start_time
-                end_date_duration = fact_end_time - datetime_split
-                if start_date_duration > end_date_duration:
-                    # most of the task was done during the previous day
-                    fact_date = fact_start_date
-                else:
-                    fact_date = fact_end_date
+                end_time = fact.end_time
+            elif start_time.date() == today or start_time >= recent:
+                end_time = now
             else:
-                # either doesn't span or more than 24 hrs tracked
-                # (in which case we give up)
-                fact_date = fact_start_date
+                end_time = start_time
+
+            start_date = start_time.date()
+            if start_time.time() < split_time:
+                start_date -= one_day
+            end_date = end_time.date()
+            if end_time.time() < split_time:
+                end_date -= one_day
+
+            # either doesn't span or more than 24 hrs tracked
+            # (in which case we give up)
+            if end_date - start_date == one_day:
+                datetime_split = dt.datetime.combine(end_date, split_time)
+                if datetime_split - start_time <= end_time - datetime_split:
+                    # most of the task was done during the next day,
+                    # move it there (as fact.set_date(end_date) would)
+                    fact.start_time = start_time + one_day
+                    if fact.end_time:
+                        fact.end_time = fact.end_time + one_day
+
+            yield fact
+
+    def get_day_totals(self, date, end_date=None, group_by="category"):
+        """Like get_totals, but read from the day_totals rollup instead of
+        the facts, so long ranges cost a row per day and activity.
+
+        Only facts assigned to the hamster days from date to end_date
+        count, there is no search, and facts without tags are left out
+        of the tag totals.
+        """
+        keys = {"day": "r.day", "activity": "b.name",
+                "category": "coalesce(c.name, ?)", "tag": "e.name"}
+        if group_by not in keys:
+            raise ValueError("can not group totals by %r" % group_by)
+
+        day_start = conf.day_start.hour * 60 + conf.day_start.minute
+        if self.fetchone("SELECT minutes FROM day_totals_start")[0] \
+           != day_start:
+            # day start changed since the totals were bucketed
+            self.rebuild_day_totals()
 
-            if fact.start_time < start - dt.timedelta(days=30):
-                # ignoring old on-going facts
+        end_date = end_date or date
+        query = """
+            SELECT %s AS key, sum(r.duration) AS duration
+              FROM day_totals r
+         LEFT JOIN activities b ON b.id = r.activity_id
+         LEFT JOIN categories c ON c.id = b.category_id
+         LEFT JOIN tags e ON e.id = r.tag_id
+             WHERE r.day BETWEEN ? AND ?
+               AND r.tag_id %s 0
+          GROUP BY key
+        """ % (keys[group_by], "!=" if group_by == "tag" else "=")
+        params = (date.isoformat(), end_date.isoformat())
+        if group_by == "category":
+            params = (self._unsorted,) + params
+
+        totals = {}
+        for row in self.fetchall(query, params):
+            key = row["key"]
+            if group_by == "day":
+                key = dt.date.fromisoformat(key)
+            totals[key] = dt.timedelta(seconds=row["duration"])
+
+        # ongoing facts are not in the rollup, they are still growing
+        ongoing = self._assign_dates(map(self._fact_from_row, self.fetchall(
+            self.fact_query + " WHERE a.end_time IS NULL", (self._unsorted,))))
+        for fact in ongoing:
+            if not date <= fact.date <= end_date:
                 continue
+            fact_keys = {"day": [fact.date], "activity": [fact.activity],
+                         "category": [fact.category],
+                         "tag": fact.tags}[group_by]
+            for key in fact_keys:
+                totals[key] = totals.get(key, dt.timedelta()) + fact.delta
 
-            fact.set_date(fact_date)
-            res.append(fact)
+        return sorted(totals.items(), key=lambda item: (-item[1], item[0]))
 
-        return res
+    def _match_expression(self, search_terms):
+        """Turn the search text into an fts5 query matching all the words.
+
+        Each word is quoted so that "-", "@" and the like are not taken
+        as query syntax; a trailing "*" still makes it a prefix search.
+        """
+        words = []
+        for word in search_terms.split():
+            prefix = word.endswith("*")
+            word = word.rstrip("*")
+            if word:
+                words.append('"%s"%s' % (word.replace('"', '""'),
+                                         "*" if prefix else ""))
+        return " ".join(words)
 
     def _remove_fact(self, fact_id):
         logger.info("removing fact #{}".format(fact_id))
@@ -737,8 +1427,6 @@ class Storage(gobject.GObject):
                       "DELETE FROM facts where id = ?"]
         self.execute(statements, [(fact_id,)] * 2)
 
-        self._remove_index([fact_id])
-
     def get_category_activities(self, category_id=(-1)):
         """returns list of activities, if category is specified, order by name
            otherwise - by activity_order"""
@@ -790,24 +1478,17 @@ class Storage(gobject.GObject):
                          (id,))
         else:
             self.execute("delete from activities where id = ?", (id,))
+        self._clear_caches()
 
     def remove_category(self, id):
         """move all activities to unsorted and remove category"""
 
-        affected_query = """
-            SELECT id
-              FROM facts
-             WHERE activity_id in
-                  (SELECT id FROM activities where category_id=?)
-        """
-        affected_ids = [res[0] for res in self.fetchall(affected_query, (id,))]
-
         update = "update activities set category_id = -1 where category_id = ?"
         self.execute(update, (id, ))
 
         self.execute("delete from categories where id = ?", (id, ))
-
-        self._remove_index(affected_ids)
+        self._clear_caches()
+        self.emit("facts-changed")
 
     def add_activity(self, name, category_id=None, temporary=False):
         # first check that we don't have anything like that yet
@@ -827,55 +1508,9 @@ class Storage(gobject.GObject):
                 VALUES (?, ?, ?, ?)
         """
         self.execute(query, (name, name.lower(), category_id, deleted))
+        self._clear_caches()
         return self._last_insert_rowid()
 
-    def _remove_index(self, ids):
-        """remove affected ids from the index"""
-        if not ids:
-            return
-        ids = ",".join((str(id) for id in ids))
-        logger.info("removing fact #{} from index".format(ids))
-        self.execute("DELETE FROM fact_index where id in (%s)" % ids)
-
-    def _check_index(self, start, end):
-        """check if maybe index needs rebuilding in the time span"""
-        index_query = """SELECT id
-                           FROM facts
-                          WHERE (end_time >= ? OR end_time IS NULL)
-                            AND start_time <= ?
-                            AND id not in(select id from fact_index)"""
-
-        rebuild_ids = ",".join([str(res[0]) for res in
-                                self.fetchall(index_query, (start, end))])
-
-        if rebuild_ids:
-            query = """
-                       SELECT a.id AS id,
-                              a.start_time AS start_time,
-                              a.end_time AS end_time,
-                              a.description as description,
-                              b.name AS activity, b.id as activity_id,
-                              coalesce(c.name, ?) as category,
-                              e.name as tag
-                         FROM facts a
-                    LEFT JOIN activities b ON a.activity_id = b.id
-                    LEFT JOIN categories c ON b.category_id = c.id
-                    LEFT JOIN fact_tags d ON d.fact_id = a.id
-                    LEFT JOIN tags e ON e.id = d.tag_id
-                        WHERE a.id in (%s)
-                     ORDER BY a.id
-            """ % rebuild_ids
-
-            facts = self._create_facts(self.fetchall(query, (self._unsorted,)))
-
-            insert = """INSERT INTO fact_index
-                             (id, name, category, description, tag)
-                             VALUES (?, ?, ?, ?, ?)"""
-            params = [(f.id, f.activity, f.category, f.description,
-                       ' '.join(f.tags)) for f in facts]
-
-            self.executemany(insert, params)
-
     last_sql_msg, last_sql_count = "", 0
 
     def _log_debug(self, query, params):
@@ -906,28 +1541,56 @@ class Storage(gobject.GObject):
     @property
     def connection(self):
         if self.con is None:
+            # only the declared timestamp columns need converting
             self.con = sqlite3.connect(self.db_path,
-                detect_types=sqlite3.PARSE_DECLTYPES|sqlite3.PARSE_COLNAMES)  # noqa
+                                       detect_types=sqlite3.PARSE_DECLTYPES,
+                                       cached_statements=STATEMENT_CACHE_SIZE)
             self.con.row_factory = sqlite3.Row
+            for pragma in CONNECTION_PRAGMAS:
+                self.con.execute("PRAGMA " + pragma)
+            self.__cur = self.con.cursor()
 
         return self.con
 
+    @property
+    def cursor(self):
+        """the shared cursor for statements that are read out right away"""
+        self.connection
+        return self.__cur
+
     def fetchall(self, query, params=None):
-        con = self.connection
-        cur = con.cursor()
+        cur = self.cursor
         self._log_debug(query, params)
-        if params:
-            cur.execute(query, params)
-        else:
-            cur.execute(query)
-
-        res = cur.fetchall()
-        cur.close()
-
-        return res
+        start = time.perf_counter()
+        cur.execute(query, params or ())
+        rows = cur.fetchall()
+        self.stats.record(query, time.perf_counter() - start, len(rows))
+        return rows
+
+    def fetchiter(self, query, params=None):
+        """like fetchall, but yield rows one by one from the cursor"""
+        # a cursor of its own, other queries can run while this one is read
+        cur = self.connection.cursor()
+        self._log_debug(query, params)
+        # only the time spent in sqlite counts, not that of the caller
+        seconds, rows = 0.0, 0
+        try:
+            start = time.perf_counter()
+            cur.execute(query, params or ())
+            seconds += time.perf_counter() - start
+            while True:
+                start = time.perf_counter()
+                batch = cur.fetchmany(256)
+                seconds += time.perf_counter() - start
+                if not batch:
+                    break
+                rows += len(batch)
+                yield from batch
+        finally:
+            cur.close()
+            self.stats.record(query, seconds, rows)
 
     def fetchone(self, query, params=None):
-        self._log_debug(query, params)
         res = self.fetchall(query, params)
         if res:
             return res[0]
@@ -937,10 +1600,10 @@ class Storage(gobject.GObject):
     def execute(self, statement, params=()):
         """
         execute sql statement. optionally you can give multiple statements
-        to save on cursor creation and closure
+        in a list, with a list of params to match
         """
-        con = self.__con or self.connection
-        cur = self.__cur or con.cursor()
+        cur = self.cursor
+        transaction_start = time.perf_counter()
 
         if isinstance(statement, list) is False:
             # we expect to receive instructions in list
@@ -949,51 +1612,434 @@ class Storage(gobject.GObject):
 
         for state, param in zip(statement, params):
             self._log_debug(state, param)
+            start = time.perf_counter()
             cur.execute(state, param)
+            self.stats.record(state, time.perf_counter() - start,
+                              max(cur.rowcount, 0))
 
-        if not self.__con:
-            con.commit()
-            cur.close()
+        if not self.__transaction:
+            self._commit(transaction_start)
 
     def executemany(self, statement, params=[]):
-        con = self.__con or self.connection
-        cur = self.__cur or con.cursor()
+        cur = self.cursor
 
         self._log_debug(statement, params)
+        start = time.perf_counter()
         cur.executemany(statement, params)
+        self.stats.record(statement, time.perf_counter() - start,
+                          max(cur.rowcount, 0))
 
-        if not self.__con:
-            con.commit()
-            cur.close()
+        if not self.__transaction:
+            self._commit(start)
+
+    def _commit(self, start):
+        """commit, timing the transaction from start on"""
+        self.connection.commit()
+        self.stats.record_transaction(time.perf_counter() - start)
 
     def start_transaction(self):
-        # will give some hints to execute not to close or commit anything
-        self.__con = self.connection
-        self.__cur = self.__con.cursor()
+        # will give some hints to execute not to commit anything.
+        # transactions nest, only the outermost one commits
+        if not self.__transaction:
+            self.__transaction_start = time.perf_counter()
+            self._check_data_version()
+        self.__transaction += 1
 
     def end_transaction(self):
-        self.__con.commit()
-        self.__cur.close()
-        self.__con, self.__cur = None, None
+        if self.__failed and self.__transaction == 1:
+            # an inner transaction failed, so this one can't commit either
+            self.rollback_transaction()
+            return
+        span = None
+        if self.__transaction == 1 and self.__pending:
+            span = self._pop_changed_span()
+        self.__transaction -= 1
+        if not self.__transaction:
+            self._commit(self.__transaction_start)
+            pending, self.__pending = self.__pending, []
+            if span:
+                Signals.emit(self, "range-changed", *span)
+            for name, values in pending:
+                Signals.emit(self, name, *values)
+
+    def rollback_transaction(self):
+        """End a transaction that failed. Nothing of it gets committed, nor
+        of the transactions it is nested in, and its signals are dropped."""
+        self.__transaction -= 1
+        self.__failed = True
+        if not self.__transaction:
+            self.connection.rollback()
+            self.__failed = False
+            self.__pending = []
+            self._clear_caches()  # may hold rows that are gone now
+
+    def emit(self, name, *values):
+        # listeners may read through another connection, which only sees
+        # what we committed - so inside a transaction wait for the commit
+        if self.__transaction:
+            if (name, values) not in self.__pending:
+                self.__pending.append((name, values))
+            return
+        if name == "facts-changed":
+            span = self._pop_changed_span()
+            if span:
+                Signals.emit(self, "range-changed", *span)
+        Signals.emit(self, name, *values)
+
+    def _fact_changes_triggers(self):
+        """triggers noting in fact_changes the times of the facts changed,
+        by any connection. A renamed activity or category changes all of
+        its facts"""
+        span = ("min(f.start_time), CASE WHEN count(f.end_time) < count(*)"
+                " THEN NULL ELSE max(f.end_time) END")
+        return [
+            """CREATE TRIGGER fact_changes_insert AFTER INSERT ON facts
+               BEGIN
+                   INSERT INTO fact_changes (start_time, end_time)
+                        VALUES (new.start_time, new.end_time);
+               END""",
+            """CREATE TRIGGER fact_changes_update AFTER UPDATE ON facts
+               BEGIN
+                   INSERT INTO fact_changes (start_time, end_time)
+                        VALUES (min(old.start_time, new.start_time),
+                                CASE WHEN old.end_time IS NULL
+                                       OR new.end_time IS NULL THEN NULL
+                                     ELSE max(old.end_time, new.end_time)
+                                END);
+               END""",
+            """CREATE TRIGGER fact_changes_delete AFTER DELETE ON facts
+               BEGIN
+                   INSERT INTO fact_changes (start_time, end_time)
+                        VALUES (old.start_time, old.end_time);
+               END""",
+            """CREATE TRIGGER fact_changes_activities
+               AFTER UPDATE OF name, category_id ON activities
+               BEGIN
+                   INSERT INTO fact_changes (start_time, end_time)
+                        SELECT %s FROM facts f
+                         WHERE f.activity_id = new.id
+                        HAVING count(*);
+               END""" % span,
+            """CREATE TRIGGER fact_changes_categories
+               AFTER UPDATE OF name ON categories
+               BEGIN
+                   INSERT INTO fact_changes (start_time, end_time)
+                        SELECT %s FROM facts f
+                          JOIN activities a ON a.id = f.activity_id
+                         WHERE a.category_id = new.id
+                        HAVING count(*);
+               END""" % span,
+            # keep the last FACT_CHANGES_KEPT, trimming now and then
+            """CREATE TRIGGER fact_changes_trim AFTER INSERT ON fact_changes
+               WHEN new.id %% 100 = 0
+               BEGIN
+                   DELETE FROM fact_changes WHERE id <= new.id - %d;
+               END""" % FACT_CHANGES_KEPT,
+        ]
+
+    def _pop_changed_span(self):
+        """(start_time, end_time) around the facts changed since the last
+        call, by us or others, or None if there were none"""
+        row = self.fetchone("""
+            SELECT min(f.start_time),
+                   CASE WHEN count(f.end_time) < count(*) THEN NULL
+                        ELSE max(f.end_time) END,
+                   max(f.id), min(f.id)
+              FROM fact_changes f
+             WHERE f.id > ?""", (self._seen_change,))
+        if row[2] is None:
+            return None
+        missed = row[3] > self._seen_change + 1  # trimmed before we looked
+        self._seen_change = row[2]
+        if missed:
+            return datetime.datetime.min, None
+        start_time, end_time = row[0], row[1]
+        return (dt.datetime.fromisoformat(start_time),
+                dt.datetime.fromisoformat(end_time) if end_time else None)
+
+    def check_changes(self):
+        """See if other processes or connections changed facts since the
+        last look, and if so emit range-changed and facts-changed.
+
+        Cheap enough to poll every second: it is one pragma as long as
+        nobody else commits. Returns True if facts changed.
+        """
+        data_version = self._check_data_version()
+        if data_version == self._checked_version:
+            return False
+        self._checked_version = data_version
+        last = self.fetchone("SELECT max(id) FROM fact_changes")[0]
+        if last is None or last <= self._seen_change:
+            return False
+        self.emit("facts-changed")
+        return True
 
-    def run_fixtures(self):
+    def _day_totals_columns(self, fact):
+        """SQL for the hamster day and the duration in seconds of a
+        finished fact, from the row called fact"""
+        # the same day as _assign_dates gives, for the stored day start
+        minutes = "(SELECT minutes FROM day_totals_start)"
+        to_day = "'-' || %s || ' minutes'" % minutes
+        from_day = "'+' || %s || ' minutes'" % minutes
+        values = {"fact": fact,
+                  "start": "date(%s.start_time, %s)" % (fact, to_day),
+                  "end": "date(%s.end_time, %s)" % (fact, to_day),
+                  "split": from_day}
+        day = ("CASE WHEN julianday(%(end)s) - julianday(%(start)s) = 1"
+               " AND julianday(%(end)s, %(split)s)"
+               " - julianday(%(fact)s.start_time)"
+               " <= julianday(%(fact)s.end_time)"
+               " - julianday(%(end)s, %(split)s)"
+               " THEN %(end)s ELSE %(start)s END" % values)
+        duration = ("CAST(round((julianday(%(fact)s.end_time)"
+                    " - julianday(%(fact)s.start_time)) * 86400) AS INTEGER)"
+                    % values)
+        return day, duration
+
+    def _day_totals_triggers(self):
+        """triggers keeping day_totals in step with facts and fact_tags"""
+        def change(fact, sign, tags):
+            """add (sign "+") or take away ("-") the time of the finished
+            fact for each tag_id of t in the tags FROM clause"""
+            day, duration = self._day_totals_columns(fact)
+            rows = ("SELECT %s, %s.activity_id, t.tag_id, %s%s FROM %s"
+                    " AND %s.end_time IS NOT NULL"
+                    % (day, fact, sign, duration, tags, fact))
+            statements = [
+                "INSERT INTO day_totals %s"
+                " ON CONFLICT (day, activity_id, tag_id)"
+                " DO UPDATE SET duration = duration + excluded.duration;"
+                % rows]
+            if sign == "-":
+                # drop what is left at zero
+                statements.append(
+                    "DELETE FROM day_totals WHERE duration = 0"
+                    " AND (day, activity_id, tag_id) IN"
+                    " (SELECT %s, %s.activity_id, t.tag_id FROM %s);"
+                    % (day, fact, tags))
+            return " ".join(statements)
+
+        # the fact itself as tag 0, and its tags
+        fact_tags = ("(SELECT 0 AS tag_id UNION ALL"
+                     " SELECT tag_id FROM fact_tags WHERE fact_id = {0}.id) t"
+                     " WHERE 1")
+        # the fact of a tag link
+        tag_fact = ("facts f, (SELECT {0}.tag_id AS tag_id) t"
+                    " WHERE f.id = {0}.fact_id")
+        updated = "UPDATE OF start_time, end_time, activity_id ON facts"
+        triggers = [
+            ("insert", "AFTER INSERT ON facts",
+             change("new", "+", fact_tags.format("new"))),
+            ("delete", "BEFORE DELETE ON facts",
+             change("old", "-", fact_tags.format("old"))),
+            ("update_before", "BEFORE " + updated,
+             change("old", "-", fact_tags.format("old"))),
+            ("update_after", "AFTER " + updated,
+             change("new", "+", fact_tags.format("new"))),
+            ("tag_insert", "AFTER INSERT ON fact_tags",
+             change("f", "+", tag_fact.format("new"))),
+            ("tag_delete", "BEFORE DELETE ON fact_tags",
+             change("f", "-", tag_fact.format("old"))),
+        ]
+        return ["CREATE TRIGGER day_totals_%s %s BEGIN %s END"
+                % (name, event, body) for name, event, body in triggers]
+
+    def rebuild_day_totals(self):
+        """Fill day_totals from scratch, for the configured day start."""
+        day_start = conf.day_start.hour * 60 + conf.day_start.minute
+        day, duration = self._day_totals_columns("a")
         self.start_transaction()
+        try:
+            self.execute(["UPDATE day_totals_start SET minutes = ?",
+                          "DELETE FROM day_totals"], [(day_start,), ()])
+            self.execute("""
+                INSERT INTO day_totals
+                     SELECT day, activity_id, tag_id, sum(duration)
+                       FROM (SELECT %s AS day, a.activity_id, t.tag_id,
+                                    %s AS duration
+                               FROM facts a
+                               JOIN (SELECT id AS fact_id, 0 AS tag_id
+                                       FROM facts
+                                      UNION ALL
+                                     SELECT fact_id, tag_id FROM fact_tags) t
+                                    ON t.fact_id = a.id
+                              WHERE a.end_time IS NOT NULL)
+                   GROUP BY day, activity_id, tag_id
+            """ % (day, duration))
+            self.execute("DELETE FROM day_totals WHERE duration = 0")
+        except BaseException:
+            self.rollback_transaction()
+            raise
+        self.end_transaction()
 
+    def run_fixtures(self):
         """upgrade DB to hamster version"""
+        self.start_transaction()
+        try:
+            self.__run_fixtures()
+        except BaseException:
+            self.rollback_transaction()
+            raise
+        self.end_transaction()
+
+    def __run_fixtures(self):
         version = self.fetchone("SELECT version FROM version")["version"]
         logger.debug("database version is %s" % version)
-        current_version = 9
+        current_version = 14
+        if version < current_version and not self.connection.in_transaction:
+            # sqlite3 commits DDL on its own outside of a transaction, and
+            # an interrupted upgrade would leave half of a step behind.
+            # IMMEDIATE has other processes opening the database wait
+            self.execute("BEGIN IMMEDIATE")
+            # they may have upgraded it while we waited
+            version = self.fetchone("SELECT version FROM version")["version"]
         if version < 9:
             # adding full text search
             self.execute(
                 "CREATE VIRTUAL TABLE fact_index"
                 " USING fts3(id, name, category, description, tag)")
 
+        if version < 10:
+            # indexes for the time range, autocomplete and category lookups
+            self.execute([
+                "CREATE INDEX IF NOT EXISTS idx_facts_start_end"
+                "    ON facts(start_time, end_time)",
+                "CREATE INDEX IF NOT EXISTS idx_facts_activity"
+                "    ON facts(activity_id, start_time)",
+                "CREATE INDEX IF NOT EXISTS idx_activities_category"
+                "    ON activities(category_id, deleted)",
+            ], [()] * 3)
+
+        if version < 11:
+            # full text search over fts5, with the index content read from
+            # the fact_search view and kept in sync by triggers instead of
+            # being patched up at query time
+            self.execute("DROP TABLE IF EXISTS fact_index")
+            self.execute("""
+                CREATE VIEW fact_search AS
+                     SELECT a.id, b.name, coalesce(c.name, '') AS category,
+                            a.description,
+                            (SELECT group_concat(e.name, ' ')
+                               FROM fact_tags d
+                               JOIN tags e ON e.id = d.tag_id
+                              WHERE d.fact_id = a.id) AS tag
+                       FROM facts a
+                  LEFT JOIN activities b ON a.activity_id = b.id
+                  LEFT JOIN categories c ON b.category_id = c.id""")
+            self.execute("""
+                CREATE VIRTUAL TABLE fact_index
+                 USING fts5(name, category, description, tag,
+                            content='fact_search', content_rowid='id')""")
+            self.execute(
+                "INSERT INTO fact_index(fact_index) VALUES('rebuild')")
+
+            # external content tables need the old values to drop a row,
+            # so every change removes the affected facts in a BEFORE
+            # trigger and adds them back in an AFTER one
+            unindex = """
+                INSERT INTO fact_index(fact_index, rowid, name, category,
+                                       description, tag)
+                     SELECT 'delete', id, name, category, description, tag
+                       FROM fact_search WHERE id IN (%s);"""
+            index = """
+                INSERT INTO fact_index(rowid, name, category, description,
+                                       tag)
+                     SELECT id, name, category, description, tag
+                       FROM fact_search WHERE id IN (%s);"""
+            fact_ids = {
+                "facts": "%(row)s.id",
+                "fact_tags": "%(row)s.fact_id",
+                "activities":
+                    "SELECT id FROM facts WHERE activity_id = %(row)s.id",
+                "categories": """SELECT f.id
+                                   FROM facts f
+                                   JOIN activities a ON a.id = f.activity_id
+                                  WHERE a.category_id = %(row)s.id""",
+                "tags":
+                    "SELECT fact_id FROM fact_tags WHERE tag_id = %(row)s.id",
+            }
+            triggers = [
+                ("facts", "INSERT", None, index),
+                ("facts", "UPDATE OF activity_id, description",
+                 unindex, index),
+                ("facts", "DELETE", unindex, None),
+                ("fact_tags", "INSERT", unindex, index),
+                ("fact_tags", "DELETE", unindex, index),
+                ("activities", "UPDATE OF name, category_id", unindex, index),
+                ("activities", "DELETE", unindex, index),
+                ("categories", "UPDATE OF name", unindex, index),
+                ("categories", "DELETE", unindex, index),
+                ("tags", "UPDATE OF name", unindex, index),
+                ("tags", "DELETE", unindex, index),
+            ]
+            statements = []
+            for table, event, before, after in triggers:
+                # ids do not change, so the old row does for updates too
+                row = "new" if event == "INSERT" else "old"
+                ids = fact_ids[table] % {"row": row}
+                name = "fact_index_%s_%s" % (table, event.split()[0].lower())
+                for when, action in (("BEFORE", before), ("AFTER", after)):
+                    if action:
+                        statements.append(
+                            "CREATE TRIGGER %s_%s %s %s ON %s BEGIN %s END"
+                            % (name, when.lower(), when, event, table,
+                               action % ids))
+            self.execute(statements, [()] * len(statements))
+
+        if version < 12:
+            # an r*tree over the fact times in minutes, to find overlapping
+            # facts without scanning. ongoing facts reach to the end of time
+            start = "coalesce(strftime('%s', {0}.start_time) / 60, 0)"
+            end = ("max(coalesce(strftime('%s', {0}.end_time) / 60,"
+                   " 2147483647), " + start + ")")
+            self.execute(
+                "CREATE VIRTUAL TABLE fact_intervals"
+                " USING rtree_i32(id, start_minute, end_minute)")
+            self.execute(
+                "INSERT INTO fact_intervals"
+                " SELECT id, %s, %s FROM facts"
+                % (start.format("facts"), end.format("facts")))
+            statements = [
+                "CREATE TRIGGER fact_intervals_insert AFTER INSERT ON facts"
+                " BEGIN INSERT INTO fact_intervals VALUES (new.id, %s, %s);"
+                " END" % (start.format("new"), end.format("new")),
+                "CREATE TRIGGER fact_intervals_update"
+                " AFTER UPDATE OF start_time, end_time ON facts"
+                " BEGIN UPDATE fact_intervals"
+                " SET start_minute = %s, end_minute = %s WHERE id = new.id;"
+                " END" % (start.format("new"), end.format("new")),
+                "CREATE TRIGGER fact_intervals_delete AFTER DELETE ON facts"
+                " BEGIN DELETE FROM fact_intervals WHERE id = old.id; END",
+            ]
+            self.execute(statements, [()] * len(statements))
+
+        if version < 13:
+            # time per hamster day, activity and tag of the finished facts.
+            # tag_id 0 holds the total of the facts themselves
+            self.execute([
+                "CREATE TABLE day_totals (day TEXT NOT NULL,"
+                "                         activity_id INTEGER NOT NULL,"
+                "                         tag_id INTEGER NOT NULL,"
+                "                         duration INTEGER NOT NULL,"
+                "   PRIMARY KEY (day, activity_id, tag_id)) WITHOUT ROWID",
+                "CREATE TABLE day_totals_start (minutes INTEGER)",
+                "INSERT INTO day_totals_start VALUES (0)",
+            ], [()] * 3)
+            triggers = self._day_totals_triggers()
+            self.execute(triggers, [()] * len(triggers))
+            self.rebuild_day_totals()
+
+        if version < 14:
+            # the times of changed facts, so that each connection can tell
+            # which ranges the others changed
+            self.execute("CREATE TABLE fact_changes"
+                         " (id INTEGER PRIMARY KEY, start_time, end_time)")
+            triggers = self._fact_changes_triggers()
+            self.execute(triggers, [()] * len(triggers))
+
         # at the happy end, update version number
         if version < current_version:
             # lock down current version
             self.execute("UPDATE version SET version = %d" % current_version)
             print("updated database from version %d to %d"
                   % (version, current_version))
-
-        self.end_transaction()
@@ -212,7 +212,7 @@ class CmdLineEntry(gtk.Entry):
         self.complete_tree.connect("on-click", self.on_tree_click)
         box.add(self.complete_tree)
 
-        self.storage = db.Storage()
+        self.todays_facts, self.suggestions = [], []
         self.load_suggestions()
         self.ignore_stroke = False
 
@@ -278,11 +278,22 @@ class CmdLineEntry(gtk.Entry):
 
 
     def load_suggestions(self):
-        self.todays_facts = self.storage.get_todays_facts()
+        # the lists are read off the main loop, until then we suggest nothing
+        db.get_executor().submit(self.find_suggestions,
+                                 callback=self.on_suggestions_found,
+                                 deliver=gobject.idle_add)
+
+    def on_suggestions_found(self, found):
+        self.todays_facts, self.suggestions = found
+
+    @staticmethod
+    def find_suggestions(storage):
+        """return today's facts and the (label, score) suggestions"""
+        todays_facts = storage.get_todays_facts()
 
         # list of facts of last month
         now = stuff.hamster_now()
-        last_month = self.storage.get_facts(now - dt.timedelta(days=30), now)
+        last_month = storage.get_facts(now - dt.timedelta(days=30), now)
 
         # naive recency and frequency rank
         # score is as simple as you get 30-days_ago points for each occurence
@@ -299,14 +310,16 @@ class CmdLineEntry(gtk.Entry):
                 label += " #%s" % (" #".join(fact.tags))
                 suggestions[label] += days
 
-        for rec in self.storage.get_activities():
+        for rec in storage.get_activities():
             label = rec["name"]
             if rec["category"]:
                 label += "@%s" % rec["category"]
             suggestions[label] += 0
 
         # list of (label, score), higher scores first
-        self.suggestions = sorted(suggestions.items(), key=lambda x: x[1], reverse=True)
+        suggestions = sorted(suggestions.items(), key=lambda x: x[1],
+                             reverse=True)
+        return todays_facts, suggestions
 
     def complete_first(self):
         text = self.get_text()
@@ -520,11 +533,12 @@ class ActivityEntry():
         if self.filter_on_category:
             category_names = [self.category_widget.get_text()]
         else:
-            category_names = [category['name']
-                              for category in runtime.storage.get_categories()]
+            category_names = [
+                category['name']
+                for category in db.get_storage().get_categories()]
         for category_name in category_names:
-            category_id = runtime.storage.get_category_id(category_name)
-            activities = runtime.storage.get_category_activities(category_id)
+            category_id = db.get_storage().get_category_id(category_name)
+            activities = db.get_storage().get_category_activities(category_id)
             for activity in activities:
                 activity_name = activity["name"]
                 text = "{}@{}".format(activity_name, category_name)
@@ -590,7 +604,7 @@ class CategoryEntry():
 
     def populate_completions(self):
         self.model.clear()
-        for category in runtime.storage.get_categories():
+        for category in db.get_storage().get_categories():
             self.model.append([category['name']])
 
     def __getattr__(self, name):
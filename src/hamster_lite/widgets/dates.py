@@ -183,6 +183,15 @@ class RangePick(gtk.ToggleButton):
 
 
     def prev_range(self):
+        start, end = self.get_prev_range()
+        self.emit_range(self.current_range, start, end)
+
+    def next_range(self):
+        start, end = self.get_next_range()
+        self.emit_range(self.current_range, start, end)
+
+    def get_prev_range(self):
+        """the range prev_range would go to"""
         start, end = self.start_date, self.end_date
 
         if self.current_range == "day":
@@ -198,10 +207,10 @@ class RangePick(gtk.ToggleButton):
             days =  (end - start) + dt.timedelta(days = 1)
             start = start - days
             end = end - days
-        self.emit_range(self.current_range, start, end)
-
+        return start, end
 
-    def next_range(self):
+    def get_next_range(self):
+        """the range next_range would go to"""
         start, end = self.start_date, self.end_date
 
         if self.current_range == "day":
@@ -217,8 +226,7 @@ class RangePick(gtk.ToggleButton):
             days =  (end - start) + dt.timedelta(days = 1)
             start = start + days
             end = end + days
-
-        self.emit_range(self.current_range, start, end)
+        return start, end
 
 
 
@@ -61,6 +61,8 @@ class FactTree(gtk.ScrolledWindow):
 
         self.current_iter = None
         self.current_fact = None
+        self.facts = []
+        self.ongoing = []  # store rows of facts without end time
 
         select = self.treeview.get_selection()
         select.connect("changed", self._on_selection_changed)
@@ -76,9 +78,10 @@ class FactTree(gtk.ScrolledWindow):
     def update_facts(self, facts):
 
         self.store.clear()
+        self.facts = facts or []
+        self.ongoing = []
         if not facts:
             return
-        self.facts = facts
         prev_date = None
         for idx, fact in enumerate(facts):
             if fact.date != prev_date:
@@ -91,6 +94,8 @@ class FactTree(gtk.ScrolledWindow):
             start_end = fact.start_time.strftime('%H:%M - ')
             if fact.end_time:
                 start_end += fact.end_time.strftime('%H:%M')
+            else:
+                self.ongoing.append(idx)
             activity = escape_pango(fact.activity)
             if fact.category:
                 activity += ' - ' + escape_pango(fact.category)
@@ -105,3 +110,10 @@ class FactTree(gtk.ScrolledWindow):
             self.store.append([date, start_end, activity, time, idx])
         self.treeview.expand_all()
         self.treeview.show()
+
+    def update_ongoing(self):
+        """Refresh the duration column of ongoing facts only."""
+        for idx in self.ongoing:
+            fact = self.facts[idx]
+            self.store[idx][3] = format_duration(
+                hamster_now() - fact.start_time)
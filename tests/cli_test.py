@@ -0,0 +1,115 @@
+import sys, os.path
+# a convoluted line to add hamster_lite module to absolute path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+
+import json
+import subprocess
+import tempfile
+import unittest
+
+SCRIPT = os.path.realpath(
+    os.path.join(os.path.dirname(__file__), "../src/hamster-lite"))
+
+# run the script, then report which modules the action pulled in
+RUNNER = """
+import json, os, runpy, sys
+sys.path.insert(0, os.path.dirname({script!r}))
+sys.argv = [{script!r}] + {args!r}
+runpy.run_path({script!r}, run_name="__main__")
+print(json.dumps(sorted(sys.modules)))
+"""
+
+# GUI modules that data commands must not load, not even GObject
+GUI_MODULES = ("gi", "cairo")
+
+
+class TestHeadlessCommands(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        tmp = self.tmp_dir.name
+        self.env = dict(os.environ,
+                        XDG_DATA_HOME=os.path.join(tmp, "data"),
+                        XDG_CONFIG_HOME=os.path.join(tmp, "conf"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_action(self, *args):
+        code = RUNNER.format(script=SCRIPT, args=list(args))
+        output = subprocess.run([sys.executable, "-c", code], env=self.env,
+                                check=True, stdout=subprocess.PIPE,
+                                universal_newlines=True).stdout
+        return json.loads(output.splitlines()[-1])
+
+    def assertHeadless(self, *args):
+        modules = self.run_action(*args)
+        loaded = [name for name in modules
+                  if name.split(".")[0] in GUI_MODULES]
+        self.assertEqual(loaded, [], "%s loaded GUI modules" % (args,))
+
+    def test_data_commands_headless(self):
+        self.assertHeadless("start", "testing@cli")
+        for action in ("current", "list", "activities", "categories"):
+            self.assertHeadless(action)
+        self.assertHeadless("search", "testing")
+        self.assertHeadless("export", "tsv")
+        self.assertHeadless("current", "--format", "{activity}")
+        self.assertHeadless("stop")
+        self.assertHeadless("db-stats")
+
+    def run_script(self, *args):
+        return subprocess.run([sys.executable, SCRIPT] + list(args),
+                              env=self.env, check=True, stdout=subprocess.PIPE,
+                              universal_newlines=True).stdout
+
+    def test_current_format(self):
+        self.run_script("start", "testing@cli, notes #tag")
+        self.assertEqual(
+            self.run_script("current", "--format",
+                            "{activity}|{category}|{description}|{tags}"),
+            "testing|cli|notes|#tag\n")
+
+    def test_current_bad_format(self):
+        # refused before looking at the facts, even with none going on
+        for format in ("{nothing}", "{activity", "{0}"):
+            result = subprocess.run(
+                [sys.executable, SCRIPT, "current", "--format", format],
+                env=self.env, stderr=subprocess.PIPE, universal_newlines=True)
+            self.assertEqual(result.returncode, 2)
+            self.assertIn("bad --format", result.stderr)
+
+    def test_current_watch(self):
+        self.run_script("current")  # set up the database
+        watch = subprocess.Popen([sys.executable, SCRIPT, "current", "--watch",
+                                  "--format", "{activity} {duration}"],
+                                 env=self.env, stdout=subprocess.PIPE,
+                                 universal_newlines=True)
+        self.addCleanup(watch.wait)
+        self.addCleanup(watch.stdout.close)
+        self.addCleanup(watch.kill)
+        self.assertEqual(watch.stdout.readline(), "No activity\n")
+        self.run_script("start", "watching")
+        # 00:00, or 00:01 if a minute turned in between
+        self.assertRegex(watch.stdout.readline(), r"^watching 00:0[01]\n$")
+        self.run_script("stop")
+        self.assertEqual(watch.stdout.readline(), "No activity\n")
+
+    def test_db_stats(self):
+        stats_file = os.path.join(self.tmp_dir.name, "stats.json")
+        self.env["HAMSTER_LITE_DB_STATS"] = stats_file
+        self.run_action("start", "testing@cli")
+        with open(stats_file) as f:
+            stats = json.load(f)
+        self.assertTrue(any(row["statement"].startswith("INSERT INTO facts")
+                            for row in stats["statements"]))
+        self.assertGreater(stats["transactions"]["calls"], 0)
+
+        output = subprocess.run([sys.executable, SCRIPT, "db-stats"],
+                                env=self.env, check=True,
+                                stdout=subprocess.PIPE,
+                                universal_newlines=True).stdout
+        self.assertIn("INSERT INTO facts", output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import sys, os.path
+# a convoluted line to add hamster_lite module to absolute path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+
+import datetime as dt
+import json
+import tempfile
+import unittest
+
+from hamster_lite.lib.configuration import conf
+
+
+class TestConfStore(unittest.TestCase):
+    def setUp(self):
+        self.saved = conf.config_file, dict(conf.config)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        conf.config_file = os.path.join(self.tmp_dir.name, "hamster-lite.json")
+        conf.set("day_start_minutes", 6 * 60)
+
+    def tearDown(self):
+        conf.config_file, conf.config = self.saved
+        conf._mtime, conf._day_start = None, None
+        self.tmp_dir.cleanup()
+
+    def write_external(self, **values):
+        """Change the file behind the back of conf, as other processes do."""
+        config = dict(conf.config, **values)
+        with open(conf.config_file, "w") as f:
+            json.dump(config, f)
+        mtime = os.stat(conf.config_file).st_mtime + 1
+        os.utime(conf.config_file, (mtime, mtime))
+
+    def test_day_start_cached(self):
+        self.assertEqual(conf.day_start, dt.time(6, 0))
+        self.assertIs(conf.day_start, conf.day_start)
+
+    def test_set_updates_day_start(self):
+        conf.set("day_start_minutes", 4 * 60 + 15)
+        self.assertEqual(conf.day_start, dt.time(4, 15))
+
+    def test_external_change_reloaded(self):
+        conf._last_check = 0
+        conf.day_start
+        self.write_external(day_start_minutes=7 * 60)
+        conf._last_check = 0
+        self.assertEqual(conf.day_start, dt.time(7, 0))
+        self.assertEqual(conf.get("day_start_minutes"), 7 * 60)
+
+    def test_no_reload_within_interval(self):
+        conf.day_start
+        self.write_external(day_start_minutes=7 * 60)
+        # checked just now, so the change is not seen yet
+        self.assertEqual(conf.day_start, dt.time(6, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
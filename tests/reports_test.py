@@ -0,0 +1,48 @@
+import sys, os.path
+# a convoluted line to add hamster_lite module to absolute path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+
+import datetime as dt
+import tempfile
+import unittest
+
+from hamster_lite import reports
+from hamster_lite.lib import Fact, i18n
+
+i18n.setup_i18n()
+
+
+def make_facts():
+    start_time = dt.datetime(2020, 3, 4, 10, 0)
+    for i in range(3):
+        yield Fact(activity="activity %d" % i, category="work",
+                   tags=["tag%d" % i],
+                   start_time=start_time + dt.timedelta(hours=i),
+                   end_time=start_time + dt.timedelta(hours=i, minutes=45))
+
+
+class TestSimple(unittest.TestCase):
+    def write(self, format):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "report")
+            reports.simple(make_facts(), dt.date(2020, 3, 4),
+                           dt.date(2020, 3, 4), format, path)
+            with open(path) as f:
+                return f.read()
+
+    def test_formats_from_generator(self):
+        for format in ("tsv", "xml", "ical", "html"):
+            report = self.write(format)
+            for i in range(3):
+                self.assertIn("activity %d" % i, report, format)
+
+    def test_input_untouched(self):
+        facts = list(make_facts())
+        facts[0].category = None
+        reports.simple(facts, dt.date(2020, 3, 4), dt.date(2020, 3, 4),
+                       "tsv", os.devnull)
+        self.assertEqual(facts[0].category, "")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,941 @@
+import sys, os.path
+# a convoluted line to add hamster_lite module to absolute path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "../src"))
+
+import datetime as dt
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+
+from hamster_lite.lib import Fact
+from hamster_lite.lib.configuration import conf
+from hamster_lite.lib.stuff import hamster_now, hamster_today
+from hamster_lite import storage
+from hamster_lite.storage import Storage
+
+TEMPLATE_DB = os.path.join(os.path.dirname(__file__), "../data/hamster.db")
+
+
+class RecordingStorage(Storage):
+    """Storage that remembers the queries it ran, for plan inspection."""
+    def __init__(self, *args, **kwargs):
+        self.queries = []
+        super().__init__(*args, **kwargs)
+
+    def fetchall(self, query, params=None):
+        self.queries.append((query, params or ()))
+        return super().fetchall(query, params)
+
+    def fetchiter(self, query, params=None):
+        self.queries.append((query, params or ()))
+        return super().fetchiter(query, params)
+
+
+class StorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+        shutil.copy(TEMPLATE_DB, os.path.join(self.db_dir, "hamster.db"))
+        self.storage = RecordingStorage(database_dir=self.db_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.db_dir)
+
+    def add(self, text, date=dt.date(2020, 3, 4)):
+        fact = Fact.parse(text, date)
+        return self.storage.add_fact(fact)
+
+    def query_plan(self, query, params):
+        rows = self.storage.fetchall("EXPLAIN QUERY PLAN " + query, params)
+        return [row["detail"] for row in rows]
+
+
+class TestQueryPlans(StorageTestCase):
+    def assertUsesIndex(self, plan, table, index):
+        for detail in plan:
+            if detail.startswith("SCAN %s" % table):
+                self.fail("full scan of %s: %s" % (table, plan))
+        self.assertTrue(any(index in detail for detail in plan), plan)
+
+    def last_query(self, method, *args):
+        self.storage.queries = []
+        method(*args)
+        return self.storage.queries[-1]
+
+    def test_migration_adds_indexes(self):
+        indexes = [row["name"] for row in self.storage.fetchall(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")]
+        self.assertIn("idx_facts_start_end", indexes)
+        self.assertIn("idx_facts_activity", indexes)
+        self.assertIn("idx_activities_category", indexes)
+        version = self.storage.fetchone("SELECT version FROM version")
+        self.assertEqual(version["version"], 14)
+
+    def test_get_facts_plan(self):
+        query, params = self.last_query(
+            self.storage.get_facts, dt.date(2020, 3, 1), dt.date(2020, 3, 31))
+        plan = self.query_plan(query, params)
+        self.assertUsesIndex(plan, "a", "idx_facts_start_end")
+
+    def test_search_plan(self):
+        self.add("10:00-11:00 reading@books, chapter one")
+        self.storage.queries = []
+        self.storage.get_facts(dt.date(2020, 3, 1), dt.date(2020, 3, 31),
+                               "chapter*")
+        # the index is kept up to date on write, searching is one query
+        self.assertEqual(len(self.storage.queries), 1)
+        query, params = self.storage.queries[0]
+        plan = self.query_plan(query, params)
+        # either side can drive the lookup, as long as it is not a full scan
+        self.assertUsesIndex(plan, "a", "SEARCH a")
+        self.assertTrue(any("fact_index VIRTUAL TABLE INDEX 0:M" in detail
+                            for detail in plan), plan)
+
+    def test_overlaps_plan(self):
+        self.storage.queries = []
+        self.storage.get_overlap_changes(dt.datetime(2020, 3, 4, 10, 0),
+                                         dt.datetime(2020, 3, 4, 11, 0))
+        query, params = self.storage.queries[-1]
+        plan = self.query_plan(query, params)
+        # index 2 is a search on the r*tree coordinates
+        self.assertTrue(any("r VIRTUAL TABLE INDEX 2:" in detail
+                            for detail in plan), plan)
+        self.assertUsesIndex(plan, "a", "SEARCH a")
+
+    def test_get_activities_plan(self):
+        query, params = self.last_query(self.storage.get_activities, "re")
+        plan = self.query_plan(query, params)
+        self.assertUsesIndex(plan, "f", "idx_facts_activity")
+
+    def test_get_category_activities_plan(self):
+        query, params = self.last_query(
+            self.storage.get_category_activities, 1)
+        plan = self.query_plan(query, params)
+        self.assertUsesIndex(plan, "a", "idx_activities_category")
+
+
+class TestGetFacts(StorageTestCase):
+    def test_range_boundaries(self):
+        self.add("10:00-11:00 inside", dt.date(2020, 3, 4))
+        self.add("10:00-11:00 before", dt.date(2020, 3, 2))
+        self.add("10:00-11:00 after", dt.date(2020, 3, 6))
+        facts = self.storage.get_facts(dt.date(2020, 3, 3),
+                                       dt.date(2020, 3, 5))
+        self.assertEqual([fact.activity for fact in facts], ["inside"])
+
+    def test_fact_spanning_range_start(self):
+        fact = Fact(activity="overnight",
+                    start_time=dt.datetime(2020, 3, 2, 22, 0),
+                    end_time=dt.datetime(2020, 3, 3, 12, 0))
+        self.storage.add_fact(fact)
+        facts = self.storage.get_facts(dt.date(2020, 3, 3))
+        self.assertEqual([fact.activity for fact in facts], ["overnight"])
+
+    def test_spanning_fact_goes_to_longer_day(self):
+        day_start = dt.datetime.combine(dt.date(2020, 3, 4), conf.day_start)
+        fact = Fact(activity="mostly late",
+                    start_time=day_start - dt.timedelta(hours=1),
+                    end_time=day_start + dt.timedelta(hours=5))
+        self.storage.add_fact(fact)
+        fact = Fact(activity="mostly early",
+                    start_time=day_start + dt.timedelta(days=2, hours=-5),
+                    end_time=day_start + dt.timedelta(days=2, hours=1))
+        self.storage.add_fact(fact)
+        facts = self.storage.get_facts(dt.date(2020, 3, 1),
+                                       dt.date(2020, 3, 31))
+        self.assertEqual([(fact.activity, fact.date) for fact in facts],
+                         [("mostly late", dt.date(2020, 3, 4)),
+                          ("mostly early", dt.date(2020, 3, 5))])
+
+    def test_iter_facts(self):
+        self.add("10:00-11:00 first #one #two")
+        self.add("11:00-12:00 second")
+        facts = self.storage.iter_facts(dt.date(2020, 3, 4))
+        self.assertEqual(next(facts).tags, ["one", "two"])
+        self.assertEqual(next(facts).activity, "second")
+        self.assertEqual(list(facts), [])
+        self.assertEqual(self.storage.get_facts(dt.date(2020, 3, 4)),
+                         list(self.storage.iter_facts(dt.date(2020, 3, 4))))
+
+    def test_old_facts_ignored(self):
+        fact = Fact(activity="forgotten",
+                    start_time=dt.datetime(2020, 1, 1, 10, 0))
+        self.storage.add_fact(fact)
+        self.assertEqual(self.storage.get_facts(dt.date(2020, 3, 4)), [])
+
+
+class TestSearch(StorageTestCase):
+    def search(self, terms):
+        facts = self.storage.get_facts(dt.date(2020, 3, 1),
+                                       dt.date(2020, 3, 31), terms)
+        return [fact.activity for fact in facts]
+
+    def assertIndexIntact(self):
+        self.storage.execute("INSERT INTO fact_index(fact_index, rank)"
+                             " VALUES('integrity-check', 1)")
+
+    def test_search_terms(self):
+        self.add("10:00-11:00 reading@books, chapter one #paper")
+        self.add("11:00-12:00 writing@work, report")
+        self.assertEqual(self.search("chapter"), ["reading"])
+        self.assertEqual(self.search("chap*"), ["reading"])
+        self.assertEqual(self.search("books paper"), ["reading"])
+        self.assertEqual(self.search("not chapter"), ["writing"])
+        self.assertEqual(self.search("work"), ["writing"])
+        # query syntax is taken literally
+        self.assertEqual(self.search('"chapter AND -one'), [])
+        self.assertEqual(self.search("  "), ["reading", "writing"])
+
+    def test_filter_facts(self):
+        self.add("10:00-11:00 reading@books, chapter one #paper")
+        self.add("11:00-12:00 writing@work, report")
+        facts = self.storage.get_facts(dt.date(2020, 3, 4), search_terms="r*")
+        for terms in ("chap*", "not chapter", "writing report", "", "zzz"):
+            filtered = self.storage.filter_facts(facts, terms)
+            self.assertEqual(filtered, self.storage.get_facts(
+                dt.date(2020, 3, 4), search_terms=terms), terms)
+
+    def test_index_follows_changes(self):
+        fact_id = self.add("10:00-11:00 reading@books, chapter one #paper")
+        fact = self.storage.get_fact(fact_id)
+        activity_id = fact.activity_id
+
+        self.storage.update_activity(activity_id, "studying", fact.category_id)
+        self.assertEqual(self.search("studying"), ["studying"])
+        self.assertEqual(self.search("reading"), [])
+
+        self.storage.update_category(fact.category_id, "library")
+        self.assertEqual(self.search("library"), ["studying"])
+        self.assertEqual(self.search("books"), [])
+
+        fact = self.storage.get_fact(fact_id)
+        fact_id = self.storage.update_fact(
+            fact_id, fact.copy(tags=["ink"], description="chapter two"))
+        self.assertEqual(self.search("ink two"), ["studying"])
+        self.assertEqual(self.search("paper"), [])
+        self.assertIndexIntact()
+
+        self.storage.remove_category(fact.category_id)
+        self.assertEqual(self.search("library"), [])
+        self.assertEqual(self.search("studying"), ["studying"])
+
+        self.storage.remove_fact(fact_id)
+        self.assertEqual(self.search("studying"), [])
+        self.assertIndexIntact()
+
+
+class TestOverlaps(StorageTestCase):
+    def times(self, date=dt.date(2020, 3, 4)):
+        return [(fact.activity, fact.start_time.strftime("%H:%M"),
+                 fact.end_time.strftime("%H:%M") if fact.end_time else None)
+                for fact in self.storage.get_facts(date)]
+
+    def assertIntervalsInSync(self):
+        out_of_sync = self.storage.fetchall("""
+            SELECT a.id
+              FROM facts a
+         LEFT JOIN fact_intervals r ON r.id = a.id
+             WHERE r.id IS NULL
+                OR r.start_minute != strftime('%s', a.start_time) / 60
+                OR r.end_minute != coalesce(strftime('%s', a.end_time) / 60,
+                                            2147483647)
+        """)
+        self.assertEqual([row["id"] for row in out_of_sync], [])
+        count = self.storage.fetchone("SELECT count(*) FROM fact_intervals")
+        self.assertEqual(count[0], len(self.storage.fetchall(
+            "SELECT id FROM facts")))
+
+    def test_split(self):
+        self.add("10:00-13:00 long #paper")
+        self.add("11:00-12:00 inside")
+        self.assertEqual(self.times(), [("long", "10:00", "11:00"),
+                                        ("inside", "11:00", "12:00"),
+                                        ("long", "12:00", "13:00")])
+        self.assertEqual(self.storage.get_facts(dt.date(2020, 3, 4))[2].tags,
+                         ["paper"])
+        self.assertIntervalsInSync()
+
+    def test_overlap_start_and_end(self):
+        self.add("10:00-11:00 first")
+        self.add("12:00-13:00 second")
+        self.add("10:30-12:30 middle")
+        self.assertEqual(self.times(), [("first", "10:00", "10:30"),
+                                        ("middle", "10:30", "12:30"),
+                                        ("second", "12:30", "13:00")])
+        self.assertIntervalsInSync()
+
+    def test_contained_kept(self):
+        self.add("11:00-12:00 short")
+        self.add("10:00-13:00 long")
+        self.assertEqual(self.times(), [("long", "10:00", "13:00"),
+                                        ("short", "11:00", "12:00")])
+
+    def test_ongoing_squeezed_in(self):
+        self.add("12:00-13:00 later")
+        self.add("10:00 ongoing")
+        self.assertEqual(self.times(), [("ongoing", "10:00", "12:00"),
+                                        ("later", "12:00", "13:00")])
+        self.storage.remove_fact(self.storage.get_facts(
+            dt.date(2020, 3, 4))[0].id)
+        self.add("12:30 truncating")
+        self.assertEqual(self.times(), [("later", "12:00", "12:30"),
+                                        ("truncating", "12:30", None)])
+        self.assertIntervalsInSync()
+
+    def test_dry_run(self):
+        first_id = self.add("10:00-11:00 first")
+        self.add("12:00-13:00 second")
+        before = self.times()
+        end_time, changes = self.storage.get_overlap_changes(
+            dt.datetime(2020, 3, 4, 10, 30), dt.datetime(2020, 3, 4, 12, 30))
+        self.assertEqual(self.times(), before)
+        self.assertEqual(end_time, dt.datetime(2020, 3, 4, 12, 30))
+        self.assertEqual([(fact.activity, new.start_time.hour,
+                           new.start_time.minute, new.end_time.hour,
+                           new.end_time.minute) for fact, new in changes],
+                         [("first", 10, 0, 10, 30), ("second", 12, 30, 13, 0)])
+
+        # the fact being edited does not get in its own way
+        end_time, changes = self.storage.get_overlap_changes(
+            dt.datetime(2020, 3, 4, 10, 30), dt.datetime(2020, 3, 4, 11, 30),
+            exclude_id=first_id)
+        self.assertEqual(changes, [])
+
+
+class TotalsTestCase(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add("10:00-11:00 reading@books #paper #ink")
+        self.add("11:00-11:30 writing@work #ink")
+        self.add("12:00-12:15 reading@books")
+        self.add("10:00-12:00 reading@books", dt.date(2020, 3, 5))
+        # mostly done on the 6th, where get_facts puts it too
+        day_start = dt.datetime.combine(dt.date(2020, 3, 6), conf.day_start)
+        hour = dt.timedelta(hours=1)
+        self.storage.add_fact(Fact(activity="late",
+                                   start_time=day_start - hour,
+                                   end_time=day_start + 2 * hour))
+
+    def totals(self, group_by, **kwargs):
+        return self.storage.get_totals(dt.date(2020, 3, 1),
+                                       dt.date(2020, 3, 31), group_by,
+                                       **kwargs)
+
+
+class TestTotals(TotalsTestCase):
+    def test_group_by(self):
+        def minutes(minutes):
+            return dt.timedelta(minutes=minutes)
+        self.assertEqual(self.totals("activity"),
+                         [("reading", minutes(195)), ("late", minutes(180)),
+                          ("writing", minutes(30))])
+        self.assertEqual(self.totals("category"),
+                         [("books", minutes(195)), ("", minutes(180)),
+                          ("work", minutes(30))])
+        self.assertEqual(self.totals("tag"),
+                         [(None, minutes(315)), ("ink", minutes(90)),
+                          ("paper", minutes(60))])
+        self.assertEqual(self.totals("day"),
+                         [(dt.date(2020, 3, 6), minutes(180)),
+                          (dt.date(2020, 3, 5), minutes(120)),
+                          (dt.date(2020, 3, 4), minutes(105))])
+        self.assertEqual(self.totals("activity", search_terms="ink"),
+                         [("reading", minutes(60)), ("writing", minutes(30))])
+        with self.assertRaises(ValueError):
+            self.totals("month")
+
+    def test_matches_facts(self):
+        totals = dict(self.totals("day"))
+        for fact in self.storage.get_facts(dt.date(2020, 3, 1),
+                                           dt.date(2020, 3, 31)):
+            totals[fact.date] -= fact.delta
+        self.assertEqual(set(totals.values()), {dt.timedelta()})
+
+    def test_ongoing(self):
+        fact = Fact(activity="ongoing",
+                    start_time=hamster_now() - dt.timedelta(minutes=20))
+        self.storage.add_fact(fact)
+        today = hamster_today()
+        totals = self.storage.get_totals(today - dt.timedelta(days=1), today,
+                                         "activity")
+        self.assertEqual([key for key, total in totals], ["ongoing"])
+        # unless the minute just turned
+        self.assertIn(totals[0][1], (dt.timedelta(minutes=20),
+                                     dt.timedelta(minutes=21)))
+
+
+class TestDayTotals(TotalsTestCase):
+    def rollup(self):
+        return [tuple(row) for row in self.storage.fetchall(
+            "SELECT * FROM day_totals ORDER BY day, activity_id, tag_id")]
+
+    def test_matches_get_totals(self):
+        for group_by in ("day", "activity", "category"):
+            self.assertEqual(
+                self.storage.get_day_totals(dt.date(2020, 3, 1),
+                                            dt.date(2020, 3, 31), group_by),
+                self.totals(group_by))
+        self.assertEqual(
+            self.storage.get_day_totals(dt.date(2020, 3, 1),
+                                        dt.date(2020, 3, 31), "tag"),
+            [(key, total) for key, total in self.totals("tag") if key])
+        self.assertEqual(
+            self.storage.get_day_totals(dt.date(2020, 3, 5), group_by="day"),
+            [(dt.date(2020, 3, 5), dt.timedelta(hours=2))])
+
+    def test_kept_up_to_date(self):
+        facts = self.storage.get_facts(dt.date(2020, 3, 4))
+        self.storage.remove_fact(facts[0].id)
+        self.storage.update_fact(facts[1].id,
+                                 facts[1].copy(tags=["ink", "pen"]))
+        self.add("11:15-11:45 squeezed")
+        self.add("12:05 ongoing")
+        self.storage.stop_tracking(dt.datetime(2020, 3, 4, 12, 10))
+        rollup = self.rollup()
+        self.storage.rebuild_day_totals()
+        self.assertEqual(rollup, self.rollup())
+        self.assertNotIn(0, [row[3] for row in rollup])
+
+    def test_day_start_change(self):
+        saved = conf.config_file, dict(conf.config)
+        tmp_dir = tempfile.TemporaryDirectory()
+        conf.config_file = os.path.join(tmp_dir.name, "hamster-lite.json")
+        try:
+            conf.set("day_start_minutes", 9 * 60)
+            # the late fact now ends before the day start, on the 5th
+            self.assertEqual(dict(self.totals("day"))[dt.date(2020, 3, 5)],
+                             dt.timedelta(hours=5))
+            self.assertEqual(
+                self.storage.get_day_totals(dt.date(2020, 3, 1),
+                                            dt.date(2020, 3, 31), "day"),
+                self.totals("day"))
+        finally:
+            conf.config_file, conf.config = saved
+            conf._mtime, conf._day_start = None, None
+            tmp_dir.cleanup()
+
+
+class TestAddFacts(StorageTestCase):
+    def facts(self, *texts):
+        return [Fact.parse(text, dt.date(2020, 3, 4)) for text in texts]
+
+    def times(self, facts):
+        return [(fact.start_time.strftime("%H:%M"),
+                 fact.end_time.strftime("%H:%M")) for fact in facts]
+
+    def test_all_or_nothing(self):
+        facts = self.facts("10:00-11:00 reading@books #paper",
+                           "11:00-12:00 writing@work")
+        facts[1]._description = ["can't", "bind", "this"]
+        calls = []
+        self.storage.connect("facts-changed", calls.append)
+        with self.assertRaises(Exception):
+            self.storage.add_facts(facts)
+
+        other = Storage(database_dir=self.db_dir)
+        self.assertEqual(other.get_facts(dt.date(2020, 3, 4)), [])
+        self.assertIsNone(other.get_category_id("books"))
+        self.assertEqual(other.fetchall(
+            "SELECT * FROM tags WHERE name = 'paper'"), [])
+        self.assertEqual(other.fetchall(
+            "SELECT * FROM activities WHERE name = 'reading'"), [])
+        self.assertEqual(calls, [])
+
+    def test_names_resolved(self):
+        existing = self.storage.get_fact(
+            self.add("08:00-09:00 reading@books #paper"))
+        fact_ids = self.storage.add_facts(self.facts(
+            "12:00-13:00 writing@work, report #ink #paper",
+            "10:00-11:00 reading@Books",
+            "11:00-12:00 reading",
+            "13:00-14:00 writing@Work #ink"))
+        facts = [self.storage.get_fact(fact_id) for fact_id in fact_ids]
+        self.assertEqual([fact.activity for fact in facts],
+                         ["reading", "reading", "writing", "writing"])
+        self.assertEqual(len({fact.activity_id for fact in facts}), 2)
+        self.assertEqual(facts[0].activity_id, existing.activity_id)
+        self.assertEqual(facts[1].activity_id, existing.activity_id)
+        self.assertEqual(facts[2].category, "work")
+        self.assertEqual(facts[2].tags, ["ink", "paper"])
+        self.assertEqual(facts[2].description, "report")
+        tags = self.storage.fetchall("SELECT name FROM tags")
+        self.assertEqual(sorted(tag["name"] for tag in tags), ["ink", "paper"])
+
+    def test_policies(self):
+        self.add("10:00-11:00 existing")
+        batch = self.facts("09:30-10:30 early", "10:45-12:00 late",
+                           "11:30-12:30 later")
+
+        def added(policy):
+            self.storage.start_transaction()
+            try:
+                fact_ids = self.storage.add_facts(batch, policy)
+                return self.times(self.storage.get_fact(fact_id)
+                                  for fact_id in fact_ids)
+            finally:
+                self.storage.connection.rollback()
+                self.storage.end_transaction()
+
+        self.assertEqual(added("keep"), [("09:30", "10:30"),
+                                         ("10:45", "12:00"),
+                                         ("11:30", "12:30")])
+        self.assertEqual(added("skip"), [("11:30", "12:30")])
+        self.assertEqual(added("trim"), [("09:30", "10:00"),
+                                         ("11:00", "12:00"),
+                                         ("12:00", "12:30")])
+        with self.assertRaises(ValueError):
+            self.storage.add_facts(batch, "replace")
+
+    def test_one_signal(self):
+        calls = []
+        self.storage.connect("facts-changed", calls.append)
+        self.storage.add_facts(self.facts("10:00-11:00 one",
+                                          "11:00-12:00 two"))
+        self.assertEqual(len(calls), 1)
+        self.storage.add_facts([])
+        self.assertEqual(len(calls), 1)
+
+
+class TestCaches(StorageTestCase):
+    def test_lookups_cached(self):
+        self.add("10:00-11:00 reading@books #paper")
+        for i in range(2):
+            self.storage.queries = []
+            category_id = self.storage.get_category_id("Books")
+            activity = self.storage.get_activity_by_name("Reading",
+                                                         category_id)
+            tags = self.storage._get_tag_ids(["paper"])[0]
+        self.assertEqual(activity["category"], "books")
+        self.assertEqual([tag["name"] for tag in tags], ["paper"])
+        # the second time round, not a single query
+        self.assertEqual(self.storage.queries, [])
+
+    def test_changes_seen(self):
+        fact = self.storage.get_fact(self.add("10:00-11:00 reading@books"))
+        self.storage.update_activity(fact.activity_id, "studying",
+                                     fact.category_id)
+        self.assertEqual(self.storage.get_activity_by_name("reading"), {})
+        self.storage.update_category(fact.category_id, "library")
+        activity = self.storage.get_activity_by_name("studying")
+        self.assertEqual(activity["category"], "library")
+        self.storage.remove_category(fact.category_id)
+        self.assertIsNone(self.storage.get_category_id("library"))
+
+    def test_other_process_changes_seen(self):
+        self.assertIsNone(self.storage.get_category_id("books"))
+        other = Storage(database_dir=self.db_dir)
+        category_id = other.add_category("books")
+        # seen on the next check, or when a transaction starts
+        self.storage.check_changes()
+        self.assertEqual(self.storage.get_category_id("books"), category_id)
+        other.add_category("papers")
+        self.storage.start_transaction()
+        self.assertIsNotNone(self.storage.get_category_id("papers"))
+        self.storage.end_transaction()
+
+
+class TestConnection(StorageTestCase):
+    def test_pragmas(self):
+        def pragma(name):
+            return self.storage.fetchone("PRAGMA " + name)[0]
+        self.assertEqual(pragma("journal_mode"), "wal")
+        self.assertEqual(pragma("synchronous"), 1)  # NORMAL
+        self.assertEqual(pragma("temp_store"), 2)  # MEMORY
+
+    def test_nested_transactions(self):
+        con = self.storage.connection
+        self.storage.start_transaction()
+        self.add("10:00-11:00 reading")
+        # add_fact ended its own transaction, but not the outer one
+        self.assertTrue(con.in_transaction)
+        self.storage.end_transaction()
+        self.assertFalse(con.in_transaction)
+
+    def test_failed_add_fact_rolled_back(self):
+        self.add("10:00-12:00 reading")
+        # fails after the overlaps are settled and the fact is in
+        self.storage.execute("CREATE TEMP TRIGGER fail BEFORE INSERT ON"
+                             " fact_tags"
+                             " BEGIN SELECT RAISE(ABORT, 'fail'); END")
+        calls = []
+        self.storage.connect("facts-changed", calls.append)
+        with self.assertRaises(Exception):
+            self.add("11:00-11:30 writing@work #ink")
+
+        other = Storage(database_dir=self.db_dir)
+        facts = other.get_facts(dt.date(2020, 3, 4))
+        self.assertEqual([(fact.activity, fact.start_time.hour,
+                           fact.end_time.hour) for fact in facts],
+                         [("reading", 10, 12)])
+        self.assertIsNone(other.get_category_id("work"))
+        self.assertEqual(calls, [])
+        self.assertFalse(self.storage.connection.in_transaction)
+
+    def test_failed_update_fact_rolled_back(self):
+        fact_id = self.add("10:00-11:00 reading")
+        fact = self.storage.get_fact(fact_id)
+        fact._description = ["not", "text"]  # fails in the insert
+        with self.assertRaises(Exception):
+            self.storage.update_fact(fact_id, fact)
+        with self.assertRaises(Exception):
+            self.storage.remove_fact(99999)
+        self.assertFalse(self.storage.connection.in_transaction)
+
+        # the next change still gets committed
+        self.add("12:00-13:00 writing")
+        other = Storage(database_dir=self.db_dir)
+        facts = other.get_facts(dt.date(2020, 3, 4))
+        self.assertEqual([fact.activity for fact in facts],
+                         ["reading", "writing"])
+
+    def test_failure_rolls_back_outer_transaction(self):
+        self.storage.start_transaction()
+        self.add("10:00-11:00 reading")
+        self.storage.start_transaction()
+        self.add("12:00-13:00 writing")
+        self.storage.rollback_transaction()
+        self.storage.end_transaction()
+        self.assertEqual(self.storage.get_facts(dt.date(2020, 3, 4)), [])
+        # and the next transaction is not affected
+        self.add("10:00-11:00 reading")
+        self.assertEqual(len(self.storage.get_facts(dt.date(2020, 3, 4))), 1)
+
+    def test_add_fact_commits_once(self):
+        statements = []
+        self.storage.connection.set_trace_callback(statements.append)
+        self.add("10:00-11:00 reading@books #paper #ink")
+        self.assertEqual(statements.count("COMMIT"), 1)
+
+
+class TestQueryStats(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.stats = self.storage.stats = storage.QueryStats()
+
+    def statement(self, prefix, suffix=""):
+        rows = [row for row in self.stats.summary()["statements"]
+                if row["statement"].startswith(prefix)
+                and row["statement"].endswith(suffix)]
+        self.assertEqual(len(rows), 1, rows)
+        return rows[0]
+
+    def test_shapes(self):
+        for ids in ((1,), (1, 2), (1, 2, 3)):
+            self.storage.fetchall("SELECT id FROM facts\n WHERE id IN (%s)"
+                                  % ", ".join("?" * len(ids)), ids)
+        row = self.statement("SELECT id FROM facts")
+        self.assertEqual(row["statement"],
+                         "SELECT id FROM facts WHERE id IN (?, ...)")
+        self.assertEqual(row["calls"], 3)
+
+    def test_literals_folded(self):
+        for ids, name in (((1,), "it''s"), ((1, 2), "b"), ((1, 2, 3), "c")):
+            self.storage.fetchall(
+                "SELECT id FROM activities WHERE id IN (%s) AND name = '%s'"
+                " LIMIT %d" % (", ".join(map(str, ids)), name, len(ids)))
+        row = self.statement("SELECT id FROM activities")
+        self.assertEqual(row["statement"], "SELECT id FROM activities "
+                         "WHERE id IN (?, ...) AND name = ? LIMIT ?")
+        self.assertEqual(row["calls"], 3)
+
+    def test_shapes_bounded(self):
+        for i in range(self.stats.SHAPES * 2):
+            self.storage.fetchall("SELECT %d" % i)
+        self.assertEqual(len(self.stats._shapes), self.stats.SHAPES)
+        self.assertEqual(self.statement("SELECT ?")["calls"],
+                         self.stats.SHAPES * 2)
+
+    def test_rows_and_times(self):
+        self.add("10:00-11:00 reading")
+        self.add("11:00-12:00 reading")
+        facts = self.storage.get_facts(dt.date(2020, 3, 4))
+        row = self.statement("SELECT a.id AS id",
+                             "IS NULL) ORDER BY a.start_time")
+        self.assertEqual(row["rows"], len(facts))
+        self.assertLessEqual(row["p50_ms"], row["p99_ms"])
+        self.assertGreater(row["total_ms"], 0)
+        transactions = self.stats.summary()["transactions"]
+        self.assertGreaterEqual(transactions["calls"], 2)
+
+    def test_slow_queries_logged(self):
+        self.stats.slow_ms = 0
+        with self.assertLogs("hamster_lite.storage", "WARNING") as logs:
+            self.storage.fetchall("SELECT 1")
+        self.assertIn("slow query", logs.output[0])
+
+    def test_dump(self):
+        self.storage.fetchall("SELECT 1")
+        path = os.path.join(self.db_dir, "stats.json")
+        self.stats.dump(path)
+        with open(path) as f:
+            self.assertEqual(json.load(f), self.stats.summary())
+
+
+class InterruptedUpgrade(Storage):
+    """Storage that fails the upgrade when it gets to the r*tree."""
+    def execute(self, statement, params=()):
+        if "rtree_i32" in str(statement):
+            raise RuntimeError("interrupted")
+        return super().execute(statement, params)
+
+
+class TestUpgrade(unittest.TestCase):
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+        shutil.copy(TEMPLATE_DB, os.path.join(self.db_dir, "hamster.db"))
+
+    def tearDown(self):
+        shutil.rmtree(self.db_dir)
+
+    def test_interrupted_upgrade_rolled_back(self):
+        with self.assertRaises(RuntimeError):
+            InterruptedUpgrade(database_dir=self.db_dir)
+        # nothing of the steps before is left to trip the next attempt
+        db = Storage(database_dir=self.db_dir)
+        self.assertEqual(db.fetchone("SELECT version FROM version")[0], 14)
+        fact_id = db.add_fact(Fact.parse("10:00-11:00 reading",
+                                         dt.date(2020, 3, 4)))
+        self.assertEqual([fact.id for fact in db.get_facts(
+            dt.date(2020, 3, 4), search_terms="reading")], [fact_id])
+
+
+class TestGetStorage(unittest.TestCase):
+    def setUp(self):
+        self.db_dirs = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+        for db_dir in self.db_dirs:
+            shutil.copy(TEMPLATE_DB, os.path.join(db_dir, "hamster.db"))
+
+    def tearDown(self):
+        for db_dir in self.db_dirs:
+            storage._storages.pop(os.path.realpath(db_dir), None)
+            shutil.rmtree(db_dir)
+
+    def test_shared_per_database(self):
+        first, second = self.db_dirs
+        shared = storage.get_storage(first)
+        self.assertIs(storage.get_storage(first), shared)
+        self.assertIs(storage.get_storage(first + "/"), shared)
+        self.assertIsNot(storage.get_storage(second), shared)
+
+
+class TestStorageExecutor(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.executor = storage.StorageExecutor(self.storage)
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.executor._executor.shutdown(wait=True)
+        super().tearDown()
+
+    def test_runs_on_worker_thread(self):
+        future = self.executor.submit(lambda db: (threading.get_ident(), db))
+        thread_id, worker_storage = future.result()
+        self.assertNotEqual(thread_id, threading.get_ident())
+        self.assertIsNot(worker_storage, self.storage)
+        self.assertEqual(worker_storage.db_path, self.storage.db_path)
+
+    def test_sees_our_writes(self):
+        def get_facts():
+            return self.executor.submit(
+                Storage.get_facts, dt.date(2020, 3, 4)).result()
+        self.assertEqual(get_facts(), [])
+        self.add("10:00-11:00 reading")
+        self.assertEqual([fact.activity for fact in get_facts()],
+                         ["reading"])
+
+    def test_callback_delivered(self):
+        self.add("10:00-11:00 reading")
+        results, delivered = [], threading.Event()
+
+        def deliver(callback, result):
+            callback(result)
+            delivered.set()
+        self.executor.submit(Storage.get_facts, dt.date(2020, 3, 4),
+                             callback=results.append, deliver=deliver)
+        self.assertTrue(delivered.wait(5))
+        self.assertEqual([fact.activity for fact in results[0]], ["reading"])
+
+    def test_error_skips_callback(self):
+        results = []
+        with self.assertLogs("hamster_lite.storage", "ERROR"):
+            future = self.executor.submit(lambda db: 1 / 0,
+                                          callback=results.append)
+            with self.assertRaises(ZeroDivisionError):
+                future.result()
+            # the callbacks are done once the thread is
+            self.executor._executor.shutdown(wait=True)
+        self.assertEqual(results, [])
+
+
+class TestRangeChanged(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.spans = []
+        self.storage.connect("range-changed",
+                             lambda db, start, end: self.spans.append(
+                                 (start, end)))
+
+    def test_span_of_change(self):
+        self.add("10:00-11:00 reading")
+        fact_id = self.add("12:00-13:00 writing")
+        self.storage.remove_fact(fact_id)
+        writing = (dt.datetime(2020, 3, 4, 12), dt.datetime(2020, 3, 4, 13))
+        self.assertEqual(self.spans, [
+            (dt.datetime(2020, 3, 4, 10), dt.datetime(2020, 3, 4, 11)),
+            writing, writing])
+
+    def test_span_covers_neighbours(self):
+        self.add("10:00-12:00 reading")
+        self.spans = []
+        # splits reading in two
+        self.add("10:30-11:00 writing")
+        self.assertEqual(self.spans, [
+            (dt.datetime(2020, 3, 4, 10), dt.datetime(2020, 3, 4, 12))])
+
+    def test_ongoing(self):
+        self.storage.add_fact(Fact("reading", start_time=hamster_now()))
+        self.assertIsNone(self.spans[0][1])
+
+    def test_rename(self):
+        fact = self.storage.get_fact(self.add("10:00-11:00 reading@books"))
+        self.add("10:00-11:00 other", date=dt.date(2020, 3, 9))
+        self.spans = []
+        self.storage.update_category(fact.category_id, "library")
+        self.assertEqual(self.spans, [
+            (dt.datetime(2020, 3, 4, 10), dt.datetime(2020, 3, 4, 11))])
+
+
+class TestCheckChanges(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = Storage(database_dir=self.db_dir)
+        self.changes = []
+        self.storage.connect("range-changed",
+                             lambda db, start, end: self.changes.append(
+                                 (start, end)))
+        self.storage.connect("facts-changed",
+                             lambda db: self.changes.append("facts"))
+
+    def test_nothing_changed(self):
+        self.assertFalse(self.storage.check_changes())
+        self.add("10:00-11:00 reading")
+        self.changes = []
+        # our own changes were announced already
+        self.assertFalse(self.storage.check_changes())
+        self.assertEqual(self.changes, [])
+
+    def test_other_connection(self):
+        self.other.add_fact(Fact.parse("10:00-11:00 reading",
+                                       dt.date(2020, 3, 4)))
+        self.other.add_fact(Fact.parse("13:00-14:00 writing",
+                                       dt.date(2020, 3, 5)))
+        self.assertTrue(self.storage.check_changes())
+        self.assertEqual(self.changes, [
+            (dt.datetime(2020, 3, 4, 10), dt.datetime(2020, 3, 5, 14)),
+            "facts"])
+        self.assertFalse(self.storage.check_changes())
+
+    def test_missed_changes(self):
+        self.other.add_fact(Fact.parse("10:00-11:00 reading",
+                                       dt.date(2020, 3, 4)))
+        self.other.add_fact(Fact.parse("13:00-14:00 writing",
+                                       dt.date(2020, 3, 5)))
+        # as if trimmed away before we looked
+        self.other.execute("DELETE FROM fact_changes WHERE id ="
+                           " (SELECT min(id) FROM fact_changes)")
+        self.assertTrue(self.storage.check_changes())
+        self.assertEqual(self.changes[0], (dt.datetime.min, None))
+
+
+class TestRangeCache(StorageTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = storage.RangeCache(self.storage, size=2)
+
+    def put(self, key):
+        self.cache.put(key, self.storage.get_facts(*key),
+                       self.cache.generation)
+
+    def test_changes_drop_their_ranges(self):
+        march, april = (dt.date(2020, 3, 1), dt.date(2020, 3, 31), ""), \
+            (dt.date(2020, 4, 1), dt.date(2020, 4, 30), "")
+        self.put(march)
+        self.put(april)
+        self.add("10:00-11:00 reading", date=dt.date(2020, 4, 2))
+        self.assertEqual(self.cache.get(march), [])
+        self.assertIsNone(self.cache.get(april))
+
+    def test_least_recent_dropped(self):
+        keys = [(dt.date(2020, 3, day), None, "") for day in (1, 2, 3)]
+        self.put(keys[0])
+        self.put(keys[1])
+        self.cache.get(keys[0])
+        self.put(keys[2])
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertEqual(self.cache.get(keys[0]), [])
+
+    def test_stale_put_ignored(self):
+        key = (dt.date(2020, 3, 4), None, "")
+        generation = self.cache.generation
+        facts = self.storage.get_facts(dt.date(2020, 3, 4))
+        self.add("10:00-11:00 reading")
+        self.cache.put(key, facts, generation)
+        self.assertIsNone(self.cache.get(key))
+
+    def test_fetch_keeps_facts_under_their_key(self):
+        days = [dt.date(2020, 3, day) for day in (3, 4, 5)]
+        for date in days:
+            self.add("10:00-11:00 day%d" % date.day, date=date)
+        executor = storage.StorageExecutor(self.storage)
+        keys = [(date, None, "") for date in days]
+        cache, shown = storage.RangeCache(self.storage), []
+        # the day asked for, with the days either side fetched behind it
+        cache.fetch(executor, keys[1], callback=shown.append)
+        for key in (keys[0], keys[2]):
+            cache.fetch(executor, key)
+        executor._executor.shutdown(wait=True)
+
+        def activities(facts):
+            return [fact.activity for fact in facts]
+        self.assertEqual(activities(shown[0]), ["day4"])
+        for key in keys:
+            self.assertEqual(activities(cache.get(key)),
+                             ["day%d" % key[0].day])
+
+
+class TestSignals(StorageTestCase):
+    def test_facts_changed(self):
+        calls = []
+        handler = self.storage.connect("facts-changed",
+                                       lambda db, tag: calls.append(tag),
+                                       "first")
+        self.add("10:00-11:00 reading")
+        self.assertEqual(calls, ["first"])
+
+        self.storage.disconnect(handler)
+        self.add("12:00-13:00 writing")
+        self.assertEqual(calls, ["first"])
+
+    def test_emitted_after_commit(self):
+        seen = []
+
+        def on_change(db):
+            # what another connection sees when the signal comes
+            other = Storage(database_dir=self.db_dir)
+            seen.append(len(other.get_facts(dt.date(2020, 3, 4))))
+        self.storage.connect("facts-changed", on_change)
+        fact_id = self.add("10:00-11:00 reading")
+        self.storage.update_fact(fact_id, Fact.parse("10:00-12:00 reading",
+                                                     dt.date(2020, 3, 4)))
+        # one signal for the update, not one for its add_fact too
+        self.assertEqual(seen, [1, 1])
+
+    def test_unknown_signal(self):
+        with self.assertRaises(TypeError):
+            self.storage.connect("no-such-signal", print)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -116,6 +116,16 @@ class TestActivityInputParsing(unittest.TestCase):
         fact3 = fact1.copy(tags=["changed"])
         self.assertEqual(fact3.tags, ["changed"])
 
+    def test_copy_independent(self):
+        fact1 = Fact.parse("12:25-13:25 case@cat, description #tag #bäg")
+        fact1.id = 42
+        fact2 = fact1.copy()
+        self.assertEqual(fact2.id, 42)
+        fact2.tags.append("other")
+        self.assertEqual(fact1.tags, ["tag", "bäg"])
+        with self.assertRaises(AttributeError):
+            fact1.copy(no_such_attribute=1)
+
     def test_comparison(self):
         fact1 = Fact.parse("12:25-13:25 case@cat, description #tag #bäg")
         fact2 = fact1.copy()